@@ -0,0 +1,160 @@
+"""
+Usage example:
+     python benchmark.py --recordings ./recordings --langs es --max_per_category 20 --repeat 3 --latency_ms 50 --error_rate 0.02
+
+End-to-end crawl benchmark against `replay_server.py`, with no network access needed.
+
+Every language gets a replay server of its recorded site, and every repetition runs `main.py`
+(discovery of the URLs, then the article loop) in a fresh output directory, pointed at the
+replay servers with `--base_url`. The crawler runs in a child process of its own, so that its
+CPU time and peak RSS are measured apart from the servers; articles and bytes come from its
+final metrics export (see `metrics.py`). Results are printed and appended as JSON lines to
+`--results` together with the settings, so that changes to concurrency, parsing or
+checkpointing can be compared on the same recordings.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import subprocess
+import collections
+from typing import Dict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--recordings', nargs='+', required=True, help='Record directories and/or http_cache directories')
+    parser.add_argument('-l', '--langs', default=['es'], nargs='*')
+    parser.add_argument('-m', '--max_per_category', default=-1, type=int)
+    parser.add_argument('-n', '--repeat', default=1, type=int)
+    parser.add_argument('-d', '--delay', default=0, type=float, help='Initial delay of the crawler (0 measures the crawler itself)')
+    parser.add_argument('--min_delay', default=0, type=float)
+    parser.add_argument('--latency_ms', default=0.0, type=float)
+    parser.add_argument('--jitter_ms', default=0.0, type=float)
+    parser.add_argument('--error_rate', default=0.0, type=float)
+    parser.add_argument('--throttle_rate', default=0.0, type=float)
+    parser.add_argument('--retry_after', default=1, type=int)
+    parser.add_argument('-s', '--seed', default=0, type=int)
+    parser.add_argument('-o', '--results', default='benchmark.jsonl', type=str, help='JSON lines file the results are appended to')
+    parser.add_argument('--keep_dirs', action='store_true', help='Keep the output directories of the runs')
+    return parser.parse_args()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Replay server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Replay server not listening on port {port}")
+
+
+def start_servers(args: argparse.Namespace, languages: Dict[str, tuple], log_dir: str) -> Dict[str, tuple]:
+    """ Starts one replay server per language; returns {lang: (base url, process)}. """
+    servers = {}
+    for lang in args.langs:
+        port = free_port()
+        command = [
+            sys.executable, os.path.join(HERE, "replay_server.py"), "--recordings", *args.recordings,
+            "--origin", languages[lang][0], "--port", str(port), "--latency_ms", str(args.latency_ms),
+            "--jitter_ms", str(args.jitter_ms), "--error_rate", str(args.error_rate),
+            "--throttle_rate", str(args.throttle_rate), "--retry_after", str(args.retry_after), "--seed", str(args.seed),
+        ]
+        log = open(os.path.join(log_dir, f"replay_{lang}.log"), "w")
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        wait_for_port(port, process)
+        servers[lang] = (f"http://127.0.0.1:{port}", process)
+    return servers
+
+
+def final_counters(metrics_path: str) -> Dict[str, float]:
+    """ Sums the counters of the last snapshot of a metrics.jsonl file over their labels. """
+    with open(metrics_path, encoding="utf-8") as f:
+        last = [line for line in f if line.strip()][-1]
+    totals = collections.Counter()
+    for counter in json.loads(last)["counters"]:
+        totals[counter["name"]] += counter["value"]
+        if counter["name"] == "http_requests_total":
+            totals[f"http_status_{counter['labels']['status']}"] += counter["value"]
+    return dict(totals)
+
+
+def run_crawl(args: argparse.Namespace, servers: Dict[str, tuple], out_dir: str) -> dict:
+    """ Runs main.py once against the replay servers and measures it. """
+    command = [
+        sys.executable, os.path.join(HERE, "main.py"), "--langs", *args.langs, "--out_dir", out_dir,
+        "--max_per_category", str(args.max_per_category), "--delay", str(args.delay), "--min_delay", str(args.min_delay),
+    ]
+    for lang, (base_url, _) in servers.items():
+        command += ["--base_url", f"{lang}={base_url}"]
+    with open(os.path.join(out_dir + ".log"), "w") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"main.py exited with code {process.returncode}, see {out_dir}.log")
+
+    counters = final_counters(os.path.join(out_dir, "metrics.jsonl"))
+    articles = counters.get("articles_processed_total", 0)
+    return {
+        "seconds": elapsed,
+        "articles": int(articles),
+        "articles_per_second": articles / elapsed,
+        "failed_attempts": int(counters.get("articles_failed_total", 0)),
+        "requests": int(counters.get("http_requests_total", 0)),
+        "bytes": int(counters.get("http_bytes_total", 0)),
+        "statuses": {name[len("http_status_"):]: int(value) for name, value in counters.items() if name.startswith("http_status_")},
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        "peak_rss_mb": usage.ru_maxrss / 1024,  # kilobytes on Linux
+    }
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(args)
+    sys.path.insert(0, HERE)
+    from main import languages
+
+    work_dir = tempfile.mkdtemp(prefix="wikihow_benchmark_")
+    servers = start_servers(args, languages, work_dir)
+    runs = []
+    try:
+        for k in range(args.repeat):
+            out_dir = os.path.join(work_dir, f"run_{k}")
+            result = run_crawl(args, servers, out_dir)
+            runs.append(result)
+            print(f"Run {k+1}/{args.repeat}: {result['articles']} articles in {result['seconds']:.2f}s "
+                  f"({result['articles_per_second']:.2f} articles/s), {result['bytes']/2**20:.1f} MiB, "
+                  f"CPU {result['cpu_seconds']:.2f}s, peak RSS {result['peak_rss_mb']:.0f} MiB, statuses {result['statuses']}")
+            if not args.keep_dirs:
+                shutil.rmtree(out_dir, ignore_errors=True)
+    finally:
+        for _, process in servers.values():
+            process.terminate()
+            process.wait()
+
+    best = max(runs, key=lambda run: run["articles_per_second"])
+    print(f"Best of {len(runs)}: {best['articles_per_second']:.2f} articles/s, CPU {best['cpu_seconds']:.2f}s, "
+          f"peak RSS {best['peak_rss_mb']:.0f} MiB (logs in {work_dir})")
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"time": time.time(), "settings": vars(args), "runs": runs}, ensure_ascii=False) + "\n")
@@ -0,0 +1,134 @@
+"""
+Usage example:
+     python chunking.py --data_dir ./output_final --lang es --window 3 --stride 2
+
+Splits the articles of the merged corpus into passages, so that retrieval returns the method
+(or the few steps) that answers a query instead of a whole article.
+
+Every method of an article gives one passage with its formatted answer (see `formatting.py`).
+With `--window N`, methods longer than N steps also give passages of N consecutive steps
+every `--stride` steps. Passages longer than `--max_chars` are split into runs of consecutive
+steps that fit, and a single step longer than that into pieces of `--max_chars` characters,
+so that no text is left out of the indexes. Passages are written with `corpus.ShardedWriter`
+as `passages_<lang>-0000K-of-0000N.jsonl` plus their index, one record per line:
+
+    {"passage_id": "1234:2:0-5:0", "article_id": 1234, "method_number": 2, "step_start": 0,
+     "step_end": 5, "char_start": 0, "char_end": 812, "category": "salud", "url": "...",
+     "question": "¿...?", "text": "Método 2: ..."}
+
+`article_id` is the position of the article in the merged corpus and the character offsets
+point into the formatted answer of the method, `text` being that slice. The passage id is
+made of the article, the method, the step range and the first character. Both `lexical_index.py`
+and `dense_index.py` index these shards with `--unit passages`.
+"""
+
+import json
+import argparse
+from typing import Iterator, List
+
+import corpus
+from formatting import format_answer_spans
+
+PASSAGE_FIELDS = ("article_id", "method_number", "char_start", "char_end")
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_dir', default='./output_final', type=str, help='Directory of the merged corpus')
+    parser.add_argument('-l', '--lang', default='es', type=str)
+    parser.add_argument('-w', '--window', default=0, type=int, help='Steps per sliding window (0 = whole methods only)')
+    parser.add_argument('-s', '--stride', default=0, type=int, help='Steps between windows (default: the window size)')
+    parser.add_argument('-m', '--max_chars', default=2000, type=int, help='Maximum length of a passage')
+    parser.add_argument('-n', '--num_shards', default=8, type=int)
+    return parser.parse_args()
+
+
+def passages_prefix(lang: str) -> str:
+    # Not "wikihow_<lang>_...", which merge_categories.py would take for a category file
+    return f"passages_{lang}"
+
+
+def windows(num_steps: int, window: int, stride: int) -> List[tuple]:
+    """ Step ranges of the sliding windows of a method (none if it fits in one window). """
+    if window <= 0 or num_steps <= window:
+        return []
+    starts = list(range(0, num_steps - window, stride)) + [num_steps - window]
+    return [(start, start + window) for start in sorted(set(starts))]
+
+
+def bounded(step_start: int, step_end: int, char_start: int, char_end: int, spans: List[tuple], max_chars: int) -> List[tuple]:
+    """ Splits a (step_start, step_end, char_start, char_end) range into ranges of at most `max_chars` characters. """
+    if char_end - char_start <= max_chars:
+        return [(step_start, step_end, char_start, char_end)]
+    ranges, start = [], step_start
+    while start < step_end:
+        group_start = char_start if start == step_start else spans[start][0]  # the first group keeps the header
+        end = start + 1
+        while end < step_end and spans[end][1] - group_start <= max_chars:
+            end += 1
+        group_end = spans[end - 1][1]
+        if group_end - group_start <= max_chars:
+            ranges.append((start, end, group_start, group_end))
+        else:  # a single step too long by itself
+            ranges += [(start, end, piece, min(piece + max_chars, group_end)) for piece in range(group_start, group_end, max_chars)]
+        start = end
+    if step_start == step_end:  # no steps, only a (very long) header
+        ranges = [(step_start, step_end, piece, min(piece + max_chars, char_end)) for piece in range(char_start, char_end, max_chars)]
+    return ranges
+
+
+def passage_ranges(answer: str, spans: List[tuple], window: int, stride: int, max_chars: int) -> List[tuple]:
+    """ Returns the (step_start, step_end, char_start, char_end) ranges of the passages of a method. """
+    ranges = [(0, len(spans), 0, len(answer))]
+    for step_start, step_end in windows(len(spans), window, stride):
+        ranges.append((step_start, step_end, spans[step_start][0], spans[step_end - 1][1]))
+    bounded_ranges = (piece for r in ranges for piece in bounded(*r, spans, max_chars))
+    return list(dict.fromkeys(bounded_ranges))  # a split method may give back some of its windows
+
+
+def iter_passages(record: dict, article_id: int, window: int = 0, stride: int = 0, max_chars: int = 2000) -> Iterator[dict]:
+    """ Yields the passages of one merged record. """
+    stride = stride or window
+    question = f"¿{record['title']}?"
+    for method in record["methods"]:
+        answer, spans = format_answer_spans(method)
+        for step_start, step_end, char_start, char_end in passage_ranges(answer, spans, window, stride, max_chars):
+            yield {
+                "passage_id": f"{article_id}:{method['number']}:{step_start}-{step_end}:{char_start}",
+                "article_id": article_id,
+                "method_number": method["number"],
+                "step_start": step_start,
+                "step_end": step_end,
+                "char_start": char_start,
+                "char_end": char_end,
+                "category": record["category"],
+                "url": record["url"],
+                "question": question,
+                "text": answer[char_start:char_end],
+            }
+
+
+def chunk_corpus(data_dir: str, lang: str, window: int, stride: int, max_chars: int, num_shards: int) -> str:
+    """ Writes the passages of the merged corpus of a language; returns the path of their index. """
+    index_file = corpus.index_path(data_dir, f"wikihow_{lang}")
+    # First pass only counts, so that the shards hold contiguous ranges like those of the articles
+    num_passages, num_split = 0, 0
+    for record in corpus.iter_records(index_file):
+        for method in record["methods"]:
+            answer, spans = format_answer_spans(method)
+            num_passages += len(passage_ranges(answer, spans, window, stride or window, max_chars))
+            num_split += len(answer) > max_chars
+    print(f"Split {num_split} methods longer than {max_chars} characters into several passages")
+    writer = corpus.ShardedWriter(data_dir, passages_prefix(lang), num_passages, num_shards)
+    for article_id, record in enumerate(corpus.iter_records(index_file)):
+        for passage in iter_passages(record, article_id, window, stride, max_chars):
+            writer.write(passage["category"], json.dumps(passage, ensure_ascii=False))
+    return writer.close()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(args)
+    index_file = chunk_corpus(args.data_dir, args.lang, args.window, args.stride, args.max_chars, args.num_shards)
+    print(f"Done! {corpus.load_index(index_file)['num_records']} passages indexed in {index_file}")
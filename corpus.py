@@ -0,0 +1,150 @@
+"""
+Sharded JSONL storage for the merged corpus.
+
+`ShardedWriter` spreads a stream of records over `<prefix>-00000-of-0000N.jsonl` shards
+and writes a sidecar `<prefix>.index.json` with the byte offset of every record in its
+shard, grouped by category:
+
+    {
+        "num_records": 12345,
+        "shards": ["wikihow_es-00000-of-00008.jsonl", ...],
+        "counts": {"salud": 1234, ...},
+        "categories": {"salud": [[offsets in shard 0], [offsets in shard 1], ...], ...}
+    }
+
+Readers can then seek straight to the records of a category instead of decoding
+the whole corpus, and process the shards in parallel.
+
+`merge_categories.py` can also export the corpus as a Parquet or Arrow IPC dataset
+(`wikihow_parquet/` or `wikihow_arrow/`, hive-partitioned by `lang` and `category`),
+read back by `load_columnar` without any JSON decoding.
+"""
+
+import os
+import json
+from glob import glob
+from typing import Iterable, Iterator, List, Optional
+
+
+def index_path(data_dir: str, prefix: str) -> str:
+    return os.path.join(data_dir, f"{prefix}.index.json")
+
+
+def load_index(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class ShardedWriter:
+    """ Writes JSON lines to N shards and indexes their byte offsets by category. """
+
+    def __init__(self, data_dir: str, prefix: str, num_records: int, num_shards: int):
+        self.data_dir = data_dir
+        self.prefix = prefix
+        self.num_records = max(1, num_records)
+        self.num_shards = max(1, min(num_shards, num_records or 1))
+        self.shards = [f"{prefix}-{i:05d}-of-{self.num_shards:05d}.jsonl" for i in range(self.num_shards)]
+        # Written under temporary names: the live shards stay valid for their index until `close`
+        self.files = [open(self._tmp_path(shard), "wb") for shard in self.shards]
+        self.categories = {}
+        self.position = 0
+
+    def _tmp_path(self, shard: str) -> str:
+        return os.path.join(self.data_dir, shard + ".tmp")
+
+    def write(self, category: str, line: str) -> None:
+        """ Appends one serialized record; shards hold contiguous ranges of the stream. """
+        shard = min(self.position * self.num_shards // self.num_records, self.num_shards - 1)
+        f = self.files[shard]
+        offsets = self.categories.setdefault(category.lower(), [[] for _ in self.shards])
+        offsets[shard].append(f.tell())
+        f.write(line.encode("utf-8") + b"\n")
+        self.position += 1
+
+    def close(self) -> str:
+        """ Closes the shards, moves them into place together with their index and removes stale shards. """
+        for f in self.files:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        index = {
+            "num_records": self.position,
+            "shards": self.shards,
+            "counts": {category: sum(map(len, offsets)) for category, offsets in sorted(self.categories.items())},
+            "categories": dict(sorted(self.categories.items())),
+        }
+        path = index_path(self.data_dir, self.prefix)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        for shard in self.shards:
+            os.replace(self._tmp_path(shard), os.path.join(self.data_dir, shard))
+        os.replace(path + ".tmp", path)
+        for stale in glob(os.path.join(self.data_dir, f"{self.prefix}-*-of-*.jsonl")):
+            if os.path.basename(stale) not in self.shards:
+                os.remove(stale)
+        return path
+
+
+def iter_lines(path: str, categories: Optional[Iterable[str]] = None) -> Iterator[bytes]:
+    """ Yields the raw lines of a sharded corpus, seeking only to the given categories if any. """
+    index = load_index(path)
+    data_dir = os.path.dirname(path)
+    wanted = None if categories is None else [c.lower() for c in categories]
+    for k, shard in enumerate(index["shards"]):
+        with open(os.path.join(data_dir, shard), "rb") as f:
+            if wanted is None:
+                yield from f
+                continue
+            offsets = sorted(o for c in wanted for o in index["categories"].get(c, [[]] * len(index["shards"]))[k])
+            for offset in offsets:
+                f.seek(offset)
+                yield f.readline()
+
+
+def iter_records(path: str, categories: Optional[Iterable[str]] = None) -> Iterator[dict]:
+    """ Yields the decoded records of a sharded corpus (optionally only some categories). """
+    for line in iter_lines(path, categories):
+        if line.strip():
+            yield json.loads(line)
+
+
+def shard_paths(path: str) -> List[str]:
+    index = load_index(path)
+    return [os.path.join(os.path.dirname(path), shard) for shard in index["shards"]]
+
+
+def columnar_path(data_dir: str, file_format: str = "parquet") -> str:
+    return os.path.join(data_dir, f"wikihow_{file_format}")
+
+
+def open_columnar(data_dir: str, file_format: str = "parquet"):
+    """ Opens the columnar export as a pyarrow dataset; Arrow IPC files are memory-mapped with zero-copy reads. """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    return ds.dataset(
+        columnar_path(data_dir, file_format),
+        format="ipc" if file_format == "arrow" else file_format,
+        partitioning="hive",
+        filesystem=fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def columnar_filter(lang: str, category: Optional[str] = None):
+    """ Partition filter of a language and optionally a category ("all" or None for every category). """
+    import pyarrow.dataset as ds
+
+    condition = ds.field("lang") == lang
+    if category not in (None, "all"):
+        condition = condition & (ds.field("category") == category.lower())
+    return condition
+
+
+def load_columnar(data_dir: str, category: Optional[str] = None, columns: Optional[List[str]] = None,
+                  lang: str = "es", file_format: str = "parquet"):
+    """
+    Loads the columnar export of `merge_categories.py` as a pyarrow Table.
+
+    Partitions other than the requested language/category are pruned and only `columns` are read.
+    """
+    return open_columnar(data_dir, file_format).to_table(columns=columns, filter=columnar_filter(lang, category))
@@ -1,15 +1,22 @@
 import os
-import re
 import csv
 import json
 import datasets
+import pyarrow as pa
+from glob import glob
+
+# Relative, so that `datasets` ships these modules along with this script
+from .corpus import columnar_filter, columnar_path, open_columnar
+from .formatting import to_example
 
 _DESCRIPTION = "Spanish articles from WikiHow"
 _HOMEPAGE = "https://www.wikihow.com"
 _LICENSE  = "CC BY-NC-SA 3.0"
-_VERSION = "1.1.0"
+_VERSION = "1.3.0"
 
-_DATAPATH = "wikihow_es.jsonl"
+_DATAPATH = "wikihow_es.index.json"  # sidecar index of the shards written by merge_categories.py
+_LANG = "es"
+_BATCH_SIZE = 1000
 
 _CATEGORIES = [
     "salud",
@@ -33,24 +40,7 @@ _CATEGORIES = [
     "automóviles-y-otros-vehículos",
 ]
 
-def format_methods(methods, short=False):
-    EOL = "\n" if short else "\n\n"
-    formatted = []
-    for method in methods:
-        if method["title"].lower() != "pasos":
-            content = f"Método {method['number']}: {method['title']}{EOL}"
-        else:
-            content = f"Sigue los siguientes pasos:{EOL}"
-        for step in method["steps"]:
-            step_content = re.sub(r"\n+", "\n", step).strip()
-            if short:
-                step_content = step_content.split("\n")[0]
-            content += step_content + EOL
-        formatted.append(content.strip())
-    return formatted
-
-
-class WikiHowEs(datasets.GeneratorBasedBuilder):
+class WikiHowEs(datasets.ArrowBasedBuilder):
     """ WikiHowEs: Collection of Spanish tutorials. """
 
     VERSION = datasets.Version(_VERSION)
@@ -67,6 +57,7 @@ class WikiHowEs(datasets.GeneratorBasedBuilder):
         features = datasets.Features(
             {
                 "category": datasets.Value("string"),
+                "other_categories": datasets.features.Sequence(datasets.Value("string")),
                 "question": datasets.Value("string"),
                 "introduction": datasets.Value("string"),
                 "answers": datasets.features.Sequence(datasets.Value("string")),
@@ -84,31 +75,76 @@ class WikiHowEs(datasets.GeneratorBasedBuilder):
             license=_LICENSE,
         )
 
-    @staticmethod
-    def _split_generators(dl_manager):
-        data_dir = dl_manager.download_and_extract(_DATAPATH)
+    def _split_generators(self, dl_manager):
+        index_file = dl_manager.download_and_extract(_DATAPATH)
+        # Fast path: the columnar export of merge_categories.py, next to the index, needs no JSON decoding
+        data_dir = self.config.data_dir or os.path.dirname(index_file)
+        for file_format in ("arrow", "parquet"):
+            if self._is_fresh(columnar_path(data_dir, file_format), index_file):
+                return [
+                    datasets.SplitGenerator(
+                        name=datasets.Split.TRAIN,
+                        gen_kwargs={"columnar": (data_dir, file_format)},
+                    ),
+                ]
+
+        with open(index_file, encoding="utf-8") as f:
+            index = json.load(f)
+        if self.config.name == "all":
+            shards, offsets = index["shards"], [None] * len(index["shards"])
+        else:
+            # Only the shards holding records of the category, and only their offsets
+            category_offsets = index["categories"].get(self.config.name, [])
+            shards = [shard for shard, offs in zip(index["shards"], category_offsets) if offs]
+            offsets = [offs for offs in category_offsets if offs]
+        filepaths = dl_manager.download_and_extract(shards)
         return [
             datasets.SplitGenerator(
                 name=datasets.Split.TRAIN,
                 gen_kwargs={
-                    "filepath": data_dir,
+                    "filepaths": filepaths,
+                    "offsets": offsets,
                 },
             ),
         ]
 
-    def _generate_examples(self, filepath):
-        with open(filepath, encoding="utf-8") as f:
-            for key, row in enumerate(f):
-                data = json.loads(row)
-                if self.config.name in ["all", data["category"].lower()]:
-                    yield key, {
-                        "category": data["category"],
-                        "question": f"¿{data['title']}?",
-                        "introduction": data["intro"],
-                        "answers": format_methods(data["methods"], short=False),
-                        "short_answers": format_methods(data["methods"], short=True),
-                        "num_answers": data["num_methods"],
-                        "num_refs": data["num_refs"],
-                        "expert_author": data["expert_author"],
-                        "url": data["url"],
-                    }
\ No newline at end of file
+    @staticmethod
+    def _is_fresh(columnar_dir, index_file):
+        """ Whether a columnar export exists and was written after the index of the shards (e.g. not by an older merge). """
+        files = glob(os.path.join(columnar_dir, "**", "*.*"), recursive=True)
+        return bool(files) and min(os.path.getmtime(path) for path in files) >= os.path.getmtime(index_file)
+
+    @staticmethod
+    def _read_rows(f, offsets):
+        if offsets is None:
+            offset = 0
+            for row in f:
+                yield offset, row
+                offset += len(row)
+        else:
+            for offset in offsets:
+                f.seek(offset)
+                yield offset, f.readline()
+
+    def _generate_tables(self, filepaths=None, offsets=None, columnar=None):
+        schema = self.info.features.arrow_schema
+        if columnar is not None:
+            dataset = open_columnar(*columnar)
+            batches = dataset.to_batches(columns=schema.names, filter=columnar_filter(_LANG, self.config.name), batch_size=_BATCH_SIZE)
+            for i, batch in enumerate(batches):
+                yield f"columnar:{i}", pa.Table.from_batches([batch]).cast(schema)
+            return
+
+        # Lists in gen_kwargs are split across processes, so shards are generated in parallel with num_proc > 1
+        for filepath, shard_offsets in zip(filepaths, offsets):
+            with open(filepath, "rb") as f:
+                rows, first_offset = [], None
+                for offset, row in self._read_rows(f, shard_offsets):
+                    if not rows:
+                        first_offset = offset
+                    rows.append(to_example(json.loads(row)))
+                    if len(rows) == _BATCH_SIZE:
+                        yield f"{os.path.basename(filepath)}:{first_offset}", pa.Table.from_pylist(rows, schema=schema)
+                        rows = []
+                if rows:
+                    yield f"{os.path.basename(filepath)}:{first_offset}", pa.Table.from_pylist(rows, schema=schema)
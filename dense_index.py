@@ -0,0 +1,260 @@
+"""
+Usage example:
+     python dense_index.py --data_dir ./output_final --lang es --index_dir ./index_es/dense
+     python dense_index.py --index_dir ./index_es/dense --query "cómo hacer pan" --category comida-y-diversión
+
+Dense retrieval over the merged corpus (see `merge_categories.py` and `corpus.py`).
+
+Every article (or passage, with `--unit passages`) is embedded by an encoder, any object
+with a `dim` and an `encode(texts)` method returning L2-normalized float32 rows.
+`HashingEncoder` is a dependency-free one (signed feature hashing of the tokens of
+`lexical_index.tokenize`), good enough for offline tests; other encoders are registered in
+`ENCODERS` so that the index can recreate the encoder it was built with.
+
+The index is a directory holding:
+
+    embeddings.npy   float32/float16[num_docs, dim], rows grouped by category
+    doc_ids.npy      int32[num_docs], merged-order id of the document of every row
+    urls.json        url of every row
+    passages.npy     int32[num_docs, 4], article_id, method_number, char_start, char_end of
+                     every row (only for passages, see `chunking.py`)
+    meta.json        encoder, dtype and the [start, end) rows of every category
+
+Embeddings are memory-mapped and scanned in blocks: memory stays flat as the corpus grows,
+and a query filtered by category only scans the rows of that category.
+"""
+
+import os
+import json
+import zlib
+import argparse
+from typing import Dict, Iterable, List, Optional, Union
+
+import numpy as np
+
+import corpus
+from chunking import PASSAGE_FIELDS, passages_prefix
+from formatting import to_example
+from lexical_index import field_text, print_hits, tokenize, write_metadata
+
+FIELDS = ("question", "introduction", "answers")
+PASSAGE_TEXT_FIELDS = ("question", "text")
+ENCODE_BATCH_SIZE = 256
+SCAN_BLOCK_SIZE = 16384
+
+
+class HashingEncoder:
+    """ Signed feature hashing of unigrams and bigrams into `dim` dimensions. """
+
+    name = "hashing"
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def config(self) -> dict:
+        return {"name": self.name, "dim": self.dim}
+
+    def _features(self, text: str) -> List[str]:
+        tokens = tokenize(text)
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        rows, cols, signs = [], [], []
+        for i, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(i)
+                cols.append(h % self.dim)
+                signs.append(1.0 if h & 0x80000000 else -1.0)
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), np.array(signs, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+ENCODERS = {"hashing": HashingEncoder}
+
+
+def load_encoder(config: dict):
+    """ Recreates the encoder described by `encoder.config()`. """
+    config = dict(config)
+    return ENCODERS[config.pop("name")](**config)
+
+
+def document_text(doc: dict, fields: Iterable[str] = FIELDS) -> str:
+    return "\n".join(field_text(doc, field) for field in fields)
+
+
+def build_index(index_file: str, index_dir: str, encoder, dtype: str = "float32", fields: Iterable[str] = FIELDS,
+                passages: bool = False) -> dict:
+    """
+    Embeds the merged corpus (or the passages) of `index_file` into a memory-mapped matrix; returns the metadata.
+
+    The per-category counts of the corpus index give every category a contiguous range of rows,
+    which is filled in merged order while the shards are read sequentially once.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    counts = corpus.load_index(index_file)["counts"]
+    num_docs = sum(counts.values())
+    ranges, start = {}, 0
+    for category, count in sorted(counts.items()):
+        ranges[category] = [start, start + count]
+        start += count
+
+    embeddings = np.lib.format.open_memmap(os.path.join(index_dir, "embeddings.npy"), mode="w+",
+                                           dtype=dtype, shape=(num_docs, encoder.dim))
+    doc_ids = np.lib.format.open_memmap(os.path.join(index_dir, "doc_ids.npy"), mode="w+",
+                                        dtype=np.int32, shape=(num_docs,))
+    urls = [None] * num_docs
+    refs = None
+    if passages:
+        refs = np.lib.format.open_memmap(os.path.join(index_dir, "passages.npy"), mode="w+",
+                                         dtype=np.int32, shape=(num_docs, len(PASSAGE_FIELDS)))
+    elif os.path.exists(os.path.join(index_dir, "passages.npy")):
+        os.remove(os.path.join(index_dir, "passages.npy"))
+    next_row = {category: rows[0] for category, rows in ranges.items()}
+
+    def flush(batch: List[tuple], out: np.ndarray) -> None:
+        vectors = encoder.encode([text for _, _, text in batch])
+        for (row, _, _), vector in zip(batch, vectors):
+            out[row] = vector
+
+    batch = []
+    for doc_id, doc in enumerate(corpus.iter_records(index_file)):
+        example = doc if passages else to_example(doc)
+        row = next_row[example["category"].lower()]
+        next_row[example["category"].lower()] += 1
+        doc_ids[row] = doc_id
+        urls[row] = example["url"]
+        if refs is not None:
+            refs[row] = [example[field] for field in PASSAGE_FIELDS]
+        batch.append((row, doc_id, document_text(example, fields)))
+        if len(batch) == ENCODE_BATCH_SIZE:
+            flush(batch, embeddings)
+            batch = []
+    if batch:
+        flush(batch, embeddings)
+    for array in (embeddings, doc_ids, refs):
+        if array is not None:
+            array.flush()
+    del embeddings, doc_ids, refs
+
+    meta = {
+        "num_docs": num_docs,
+        "dtype": dtype,
+        "fields": list(fields),
+        "encoder": encoder.config(),
+        "categories": ranges,
+    }
+    return write_metadata(index_dir, urls, meta)
+
+
+class DenseIndex:
+    """ Memory-mapped embedding matrix written by `build_index`, searched by blocked matrix products. """
+
+    def __init__(self, index_dir: str, encoder=None):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(index_dir, "urls.json"), encoding="utf-8") as f:
+            self.urls = json.load(f)
+        self.embeddings = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        self.doc_ids = np.load(os.path.join(index_dir, "doc_ids.npy"), mmap_mode="r")
+        passages_file = os.path.join(index_dir, "passages.npy")
+        self.passages = np.load(passages_file, mmap_mode="r") if os.path.exists(passages_file) else None
+        self.encoder = encoder or load_encoder(self.meta["encoder"])
+        self.ranges = {category: tuple(rows) for category, rows in self.meta["categories"].items()}
+        self.row_categories = sorted(self.ranges, key=self.ranges.get)
+        self.starts = [self.ranges[category][0] for category in self.row_categories]
+
+    def _rows(self, category: Optional[str]) -> tuple:
+        if category in (None, "all"):
+            return 0, len(self.embeddings)
+        return self.ranges.get(category.lower(), (0, 0))
+
+    def _category_of(self, row: int) -> str:
+        return self.row_categories[np.searchsorted(self.starts, row, side="right") - 1]
+
+    def _scan(self, vectors: np.ndarray, start: int, end: int, k: int) -> List[tuple]:
+        """ Running top-k of every query vector over rows [start, end), one block at a time. """
+        best_rows = [np.empty(0, dtype=np.int64) for _ in vectors]
+        best_scores = [np.empty(0, dtype=np.float32) for _ in vectors]
+        for block_start in range(start, end, SCAN_BLOCK_SIZE):
+            block = np.asarray(self.embeddings[block_start:min(end, block_start + SCAN_BLOCK_SIZE)], dtype=np.float32)
+            scores = vectors @ block.T  # (num_queries, block rows)
+            for q, row_scores in enumerate(scores):
+                if len(row_scores) > k:
+                    top = np.argpartition(-row_scores, k - 1)[:k]
+                else:
+                    top = np.arange(len(row_scores))
+                rows = np.concatenate([best_rows[q], top + block_start])
+                candidates = np.concatenate([best_scores[q], row_scores[top]])
+                if len(candidates) > k:
+                    keep = np.argpartition(-candidates, k - 1)[:k]
+                    rows, candidates = rows[keep], candidates[keep]
+                best_rows[q], best_scores[q] = rows, candidates
+        return list(zip(best_rows, best_scores))
+
+    def search(self, query: str, k: int = 10, category: Optional[str] = None) -> List[dict]:
+        return self.search_batch([query], k, category)[0]
+
+    def search_batch(self, queries: List[str], k: int = 10,
+                     category: Union[None, str, List[Optional[str]]] = None) -> List[List[dict]]:
+        """
+        Returns the top-k documents of every query, as {doc_id, score, url, category} dicts
+        (plus the `PASSAGE_FIELDS` of passage indexes).
+
+        `category` filters all the queries, or each one if it is a list; queries sharing a
+        filter are encoded and scanned together.
+        """
+        categories = category if isinstance(category, list) else [category] * len(queries)
+        results = [[] for _ in queries]
+        if k <= 0 or not queries:
+            return results
+        vectors = self.encoder.encode(queries).astype(np.float32)
+        groups: Dict[tuple, List[int]] = {}
+        for q, query_category in enumerate(categories):
+            groups.setdefault(self._rows(query_category), []).append(q)
+        for (start, end), members in groups.items():
+            for q, (rows, scores) in zip(members, self._scan(vectors[members], start, end, k)):
+                for i in np.lexsort((rows, -scores)):
+                    hit = {
+                        "doc_id": int(self.doc_ids[rows[i]]),
+                        "score": float(scores[i]),
+                        "url": self.urls[rows[i]],
+                        "category": self._category_of(int(rows[i])),
+                    }
+                    if self.passages is not None:
+                        hit.update(zip(PASSAGE_FIELDS, map(int, self.passages[rows[i]])))
+                    results[q].append(hit)
+        return results
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_dir', default='./output_final', type=str, help='Directory of the merged corpus')
+    parser.add_argument('-l', '--lang', default='es', type=str)
+    parser.add_argument('-i', '--index_dir', default='./index_es/dense', type=str)
+    parser.add_argument('-u', '--unit', default='articles', choices=['articles', 'passages'], help='Embed whole articles or the passages of chunking.py')
+    parser.add_argument('--dim', default=256, type=int, help='Dimension of the hashing encoder')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float16'], help='float16 halves the index but is upcast block by block when scanned')
+    parser.add_argument('-q', '--query', action='append', help='Query the index instead of building it (repeatable)')
+    parser.add_argument('-c', '--category', default=None, type=str)
+    parser.add_argument('-k', '--top_k', default=10, type=int)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.query:
+        index = DenseIndex(args.index_dir)
+        print_hits(args.query, index.search_batch(args.query, args.top_k, args.category))
+    else:
+        print(args)
+        encoder = HashingEncoder(args.dim)
+        if args.unit == "passages":
+            index_file = corpus.index_path(args.data_dir, passages_prefix(args.lang))
+            meta = build_index(index_file, args.index_dir, encoder, args.dtype, PASSAGE_TEXT_FIELDS, passages=True)
+        else:
+            meta = build_index(corpus.index_path(args.data_dir, f"wikihow_{args.lang}"), args.index_dir, encoder, args.dtype)
+        print(f"Embedded {meta['num_docs']} documents in {args.index_dir}")
@@ -1,5 +1,6 @@
 # Downloads the HTML code of all articles in the Spanish WikiHow, generating one file per category.
 # Note: The 3 seconds delay between requests is just to prevent being banned, do not remove!
+# The resulting mirror can be turned into the usual JSONL files offline with `python offline_parser.py --mirror_dir .`
 
 CATEGORIES=(
     "Adolescentes"
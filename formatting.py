@@ -0,0 +1,88 @@
+"""
+Formatting of the methods of an article into answers.
+
+Every method becomes one answer: a header ("Método N: <title>", or "Sigue los siguientes
+pasos:" for articles made of a single list of steps) followed by its steps. The long answer
+keeps the full steps separated by blank lines, the short one only the first line of each
+step. Both are produced in a single pass, normalizing every step once and joining parts
+instead of growing strings.
+
+`to_example` turns a merged record into an example of the `WikiHowEs` dataset, for the
+dataset builder and for the columnar export of `merge_categories.py` alike.
+"""
+
+import re
+from typing import Dict, List, Tuple
+
+_NEWLINES = re.compile(r"\n+")
+
+
+def method_header(method: dict) -> str:
+    if method["title"].lower() != "pasos":
+        return f"Método {method['number']}: {method['title']}"
+    return "Sigue los siguientes pasos:"
+
+
+def format_answers(methods: List[dict]) -> Tuple[List[str], List[str]]:
+    """ Returns the (long answers, short answers) of an article, one of each per method. """
+    answers, short_answers = [], []
+    for method in methods:
+        header = method_header(method)
+        long_parts, short_parts = [header], [header]
+        for step in method["steps"]:
+            step_content = _NEWLINES.sub("\n", step).strip()
+            long_parts.append(step_content)
+            short_parts.append(step_content.split("\n", 1)[0])
+        answers.append("\n\n".join(long_parts).strip())
+        short_answers.append("\n".join(short_parts).strip())
+    return answers, short_answers
+
+
+def format_answer_spans(method: dict) -> Tuple[str, List[Tuple[int, int]]]:
+    """ Returns the long answer of one method and the (start, end) character span of each of its steps. """
+    header = method_header(method)
+    parts, spans, position = [header], [], len(header)
+    for step in method["steps"]:
+        step_content = _NEWLINES.sub("\n", step).strip()
+        position += 2  # "\n\n" separator
+        spans.append((position, position + len(step_content)))
+        parts.append(step_content)
+        position += len(step_content)
+    answer = "\n\n".join(parts).strip()
+    return answer, [(min(start, len(answer)), min(end, len(answer))) for start, end in spans]
+
+
+def format_batch(batch: Dict[str, list]) -> Dict[str, list]:
+    """ Formats a columnar batch of records (e.g. `datasets.map(format_batch, batched=True)`). """
+    answers, short_answers = [], []
+    for methods in batch["methods"]:
+        long_answers, short = format_answers(methods)
+        answers.append(long_answers)
+        short_answers.append(short)
+    return {"answers": answers, "short_answers": short_answers}
+
+
+def add_answers(record: dict) -> dict:
+    """ Stores the formatted answers in a record, so that readers do not have to recompute them. """
+    record["answers"], record["short_answers"] = format_answers(record["methods"])
+    return record
+
+
+def to_example(data: dict) -> dict:
+    """ Converts a merged record into an example with the features of `WikiHowEs._info`. """
+    if "answers" in data:  # precomputed by merge_categories.py
+        answers, short_answers = data["answers"], data["short_answers"]
+    else:
+        answers, short_answers = format_answers(data["methods"])
+    return {
+        "category": data["category"],
+        "other_categories": data.get("other_categories") or [],
+        "question": f"¿{data['title']}?",
+        "introduction": data["intro"],
+        "answers": answers,
+        "short_answers": short_answers,
+        "num_answers": data["num_methods"],
+        "num_refs": data["num_refs"],
+        "expert_author": data["expert_author"],
+        "url": data["url"],
+    }
@@ -0,0 +1,339 @@
+"""
+Usage example:
+     python main.py --langs es --out_dir /shared/output --frontier sqlite --worker_id node1-a   # on every worker
+     python frontier.py --out_dir /shared/output status
+     python frontier.py --out_dir /shared/output merge
+
+Crawl frontier shared by several `main.py` processes, on one machine or several (through
+shared storage), stored in `<out_dir>/frontier.db`: SQLite in WAL mode, every change being
+its own transaction.
+
+Workers claim articles in small batches by taking a lease on them: a lease expires after
+`lease_seconds` unless its owner renews it, which a heartbeat thread does while the worker is
+alive. The articles of a worker that died are thus claimed again by the others once its leases
+expire, and no article is fetched twice while its owner is alive. Failed articles are put back
+with their lease expiring at the end of their backoff, or marked dead; their attempts are
+counted in the database, so the backoff keeps growing whichever worker retries them. Named
+locks work the same way, e.g. one per language around URL discovery, which `main.py` runs in
+`<out_dir>/discovery/<lang>/`.
+
+Every worker writes its articles to `<out_dir>/workers/<worker_id>/`; `merge` folds these
+files into the per-category files of `<out_dir>` once the workers are done.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import collections
+from glob import glob
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frontier (
+    id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    lang TEXT NOT NULL,
+    category TEXT NOT NULL,
+    page INTEGER,
+    pageid INTEGER,
+    lastrevid INTEGER,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | processed | dead
+    lease_owner TEXT,
+    lease_expires REAL,  -- end of the lease, or of the backoff of a failed article
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS frontier_claim ON frontier (status, lang, lease_expires);
+CREATE TABLE IF NOT EXISTS locks (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+_COLUMNS = ["id", "url", "lang", "category", "page", "pageid", "lastrevid", "status", "attempts"]
+
+
+def _row(values: tuple) -> dict:
+    """ Frontier row in the format of `urls.jsonl` rows. """
+    row = dict(zip(_COLUMNS, values))
+    row["is_processed"] = row["status"] == "processed"
+    return row
+
+
+class SQLiteFrontier:
+    """ Transactional frontier with lease-based claiming, sharing the interface of `CrawlLedger`. """
+
+    def __init__(self, db_path: str, worker_id: str, lease_seconds: float = 600.0, timeout: float = 60.0, read_only: bool = False,
+                 retry_schedule: Optional[Callable[[int, Exception], tuple]] = None):
+        """
+        With `read_only`, the database is only inspected (e.g. by `status`): no schema, no heartbeat, no leases.
+
+        `retry_schedule(attempts, exc)` returns whether a failed article is dead and otherwise when it may be
+        retried (see `FailureQueue.schedule`); the frontier then stands in for the failure queue of `main.py`.
+        """
+        self.db_path = db_path
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.read_only = read_only
+        self.retry_schedule = retry_schedule
+        self.records = {}  # snapshot of the rows, filled by `load`
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+        if read_only:
+            self._db = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=timeout, check_same_thread=False)
+            return
+        self._db = sqlite3.connect(db_path, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # as durable as the fsync'd journal of CrawlLedger
+        self._db.executescript(SCHEMA)
+        self._heartbeat = threading.Thread(target=self._renew_forever, daemon=True)
+        self._heartbeat.start()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """ Write transaction; BEGIN IMMEDIATE takes the database write lock up front. """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        with self._lock:
+            return self._db.execute(sql, tuple(params)).fetchall()
+
+    def import_rows(self, rows: Iterable[dict]) -> int:
+        """ Adds frontier rows (e.g. from `urls.jsonl`); known ones only get their page ids updated. Returns how many were new. """
+        with self._transaction() as db:
+            before = db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0]
+            db.executemany(
+                "INSERT INTO frontier (id, url, lang, category, page, pageid, lastrevid, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET pageid = excluded.pageid, lastrevid = excluded.lastrevid",
+                (
+                    (row["id"], row["url"], row["lang"], row["category"], row.get("page"), row.get("pageid"),
+                     row.get("lastrevid"), "processed" if row.get("is_processed") else "pending")
+                    for row in rows
+                ),
+            )
+            # Counted within the transaction, so that imports of other workers do not count
+            return db.execute("SELECT COUNT(*) FROM frontier").fetchone()[0] - before
+
+    def load(self) -> "SQLiteFrontier":
+        """ Takes a snapshot of all the rows in `records`, in frontier order. """
+        rows = self._query(f"SELECT {', '.join(_COLUMNS)} FROM frontier ORDER BY rowid")
+        self.records = {values[0]: _row(values) for values in rows}
+        return self
+
+    def claim(self, langs: List[str], limit: int) -> List[dict]:
+        """ Leases up to `limit` pending articles of the given languages to this worker, in frontier order. """
+        now = time.time()
+        marks = ",".join("?" * len(langs))
+        with self._transaction() as db:
+            rows = db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM frontier WHERE status = 'pending' AND lang IN ({marks}) "
+                f"AND (lease_expires IS NULL OR lease_expires <= ?) ORDER BY rowid LIMIT ?",
+                (*langs, now, limit),
+            ).fetchall()
+            db.executemany(
+                "UPDATE frontier SET lease_owner = ?, lease_expires = ? WHERE id = ?",
+                ((self.worker_id, now + self.lease_seconds, values[0]) for values in rows),
+            )
+        claimed = [_row(values) for values in rows]
+        self.records.update((row["id"], row) for row in claimed)
+        return claimed
+
+    def next_eligible(self, langs: List[str]) -> Optional[float]:
+        """ Returns when the next pending article leased or deferred by someone else can be claimed (None if there is none). """
+        marks = ",".join("?" * len(langs))
+        rows = self._query(
+            f"SELECT MIN(lease_expires) FROM frontier WHERE status = 'pending' AND lang IN ({marks}) "
+            f"AND (lease_owner IS NULL OR lease_owner != ?)",
+            (*langs, self.worker_id),
+        )
+        return rows[0][0]
+
+    def renew(self) -> None:
+        """ Extends all the leases held by this worker. """
+        until = time.time() + self.lease_seconds
+        with self._transaction() as db:
+            db.execute("UPDATE frontier SET lease_expires = ? WHERE lease_owner = ? AND status = 'pending'", (until, self.worker_id))
+            db.execute("UPDATE locks SET expires = ? WHERE owner = ?", (until, self.worker_id))
+
+    def _renew_forever(self) -> None:
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                self.renew()
+            except sqlite3.Error as e:  # e.g. database busy for too long: try again at the next beat
+                print(f"\tCould not renew the leases of {self.worker_id}: {e}")
+
+    def mark_processed(self, _id: str) -> None:
+        with self._transaction() as db:
+            db.execute("UPDATE frontier SET status = 'processed', lease_owner = NULL, lease_expires = NULL WHERE id = ?", (_id,))
+        if _id in self.records:
+            self.records[_id]["is_processed"] = True
+            self.records[_id]["status"] = "processed"
+
+    def record_failure(self, row: dict, exc: Exception) -> dict:
+        """
+        Counts a failed attempt in the frontier, shared by all the workers, and releases the article until the
+        end of its backoff or marks it dead, as decided by `retry_schedule(attempts, exc)`.
+        Returns the failure in the format of `FailureQueue` entries.
+        """
+        with self._transaction() as db:
+            found = db.execute("UPDATE frontier SET attempts = attempts + 1 WHERE id = ? RETURNING attempts", (row["id"],)).fetchone()
+            attempts = found[0] if found else 1
+            dead, next_eligible = self.retry_schedule(attempts, exc)
+            db.execute(
+                "UPDATE frontier SET status = ?, lease_owner = NULL, lease_expires = ? WHERE id = ?",
+                ("dead" if dead else "pending", next_eligible, row["id"]),
+            )
+        return {
+            "id": row["id"],
+            "url": row["url"],
+            "lang": row["lang"],
+            "category": row["category"],
+            "revid": row.get("lastrevid"),
+            "error": exc.__class__.__name__,
+            "message": str(exc),
+            "attempts": attempts,
+            "dead": dead,
+            "next_eligible": next_eligible,
+        }
+
+    def record_success(self, _id: str) -> None:
+        pass  # nothing to forget, `mark_processed` already cleared the article
+
+    def dead(self) -> Dict[str, dict]:
+        rows = self._query(f"SELECT {', '.join(_COLUMNS)} FROM frontier WHERE status = 'dead'")
+        return {values[0]: _row(values) for values in rows}
+
+    def revive(self, _id: str, lastrevid: Optional[int]) -> None:
+        """ Puts a dead article back in the frontier, e.g. because its page changed. """
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE frontier SET status = 'pending', attempts = 0, lastrevid = ?, lease_owner = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = 'dead'",
+                (lastrevid, _id),
+            )
+
+    @contextmanager
+    def lock(self, name: str, poll_interval: float = 5.0):
+        """ Holds a named lease (renewed by the heartbeat) for the duration of the block, waiting for it if needed. """
+        announced = False
+        while True:
+            now = time.time()
+            with self._transaction() as db:
+                holder = db.execute("SELECT owner, expires FROM locks WHERE name = ?", (name,)).fetchone()
+                if holder is None or holder[1] <= now or holder[0] == self.worker_id:
+                    db.execute("INSERT OR REPLACE INTO locks (name, owner, expires) VALUES (?, ?, ?)",
+                               (name, self.worker_id, now + self.lease_seconds))
+                    break
+            if not announced:
+                print(f"Waiting for {holder[0]} to release the {name} lock...")
+                announced = True
+            time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            with self._transaction() as db:
+                db.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, self.worker_id))
+
+    def compact(self) -> None:
+        """ Folds the write-ahead log back into the database file. """
+        self._query("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        """ Stops the heartbeat and gives back the leases of the articles this worker did not finish. """
+        if self.read_only:
+            self._db.close()
+            return
+        self._stop.set()
+        self._heartbeat.join()
+        with self._transaction() as db:
+            db.execute("UPDATE frontier SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ? AND status = 'pending'",
+                       (self.worker_id,))
+            db.execute("DELETE FROM locks WHERE owner = ?", (self.worker_id,))
+        self.compact()
+        self._db.close()
+
+    def pending(self) -> List[dict]:
+        rows = self._query(f"SELECT {', '.join(_COLUMNS)} FROM frontier WHERE status = 'pending' ORDER BY rowid")
+        return [_row(values) for values in rows]
+
+    def num_processed(self) -> int:
+        return self._query("SELECT COUNT(*) FROM frontier WHERE status = 'processed'")[0][0]
+
+    def num_unprocessed(self) -> int:
+        return self._query("SELECT COUNT(*) FROM frontier WHERE status != 'processed'")[0][0]
+
+    def status(self) -> dict:
+        """ Returns the number of articles per language and status, and the live leases per worker. """
+        now = time.time()
+        by_status = collections.defaultdict(dict)
+        for lang, status, count in self._query("SELECT lang, status, COUNT(*) FROM frontier GROUP BY lang, status"):
+            by_status[lang][status] = count
+        leases = dict(self._query(
+            "SELECT lease_owner, COUNT(*) FROM frontier WHERE lease_owner IS NOT NULL AND lease_expires > ? GROUP BY lease_owner", (now,)
+        ))
+        locks = {name: owner for name, owner, expires in self._query("SELECT name, owner, expires FROM locks") if expires > now}
+        return {"articles": dict(by_status), "leases": leases, "locks": locks}
+
+
+def merge_worker_outputs(out_dir: str) -> Dict[str, int]:
+    """
+    Folds the per-worker output files into the per-category files of `out_dir`; returns the records per file.
+
+    Records are deduplicated by URL (the last one wins, workers after the existing file), since an
+    article may have been fetched again after the lease of a slow worker expired.
+    """
+    worker_files = collections.defaultdict(list)
+    for path in sorted(glob(os.path.join(out_dir, "workers", "*", "wikihow_*.jsonl"))):
+        worker_files[os.path.basename(path)].append(path)
+    merged = {}
+    for filename, paths in sorted(worker_files.items()):
+        target = os.path.join(out_dir, filename)
+        records = {}
+        for path in ([target] if os.path.isfile(target) else []) + paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # torn last line of a killed worker
+                        continue
+                    records[record["url"]] = line if line.endswith("\n") else line + "\n"
+        with open(target + ".tmp", "w", encoding="utf-8") as f:
+            f.writelines(records.values())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(target + ".tmp", target)
+        for path in paths:
+            os.remove(path)
+        merged[filename] = len(records)
+    return merged
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--out_dir', default='./output', type=str)
+    parser.add_argument('command', choices=['status', 'merge'], help='Show the progress of the workers, or merge their outputs')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "status":
+        frontier = SQLiteFrontier(os.path.join(args.out_dir, "frontier.db"), worker_id="status", read_only=True)
+        print(json.dumps(frontier.status(), indent=2, ensure_ascii=False))
+        frontier.close()
+    else:
+        for filename, num_records in merge_worker_outputs(args.out_dir).items():
+            print(f"{filename}: {num_records} records")
@@ -0,0 +1,226 @@
+"""
+Shared HTTP layer for the crawler: pooled keep-alive sessions plus an on-disk cache.
+
+Every thread gets its own `requests.Session` (sessions are not thread-safe), so
+connections to a WikiHow host are reused instead of paying a new TCP+TLS
+handshake per request.
+
+Cached responses are stored by URL with their `ETag`/`Last-Modified` validators
+and revalidated with conditional GETs. Bodies are content-addressed (by their
+SHA-256), and so are parsed results: when the server answers `304 Not Modified`
+or sends back identical bytes, the previous parse is reused as well.
+
+When a throttle is configured, every request waits for its host's turn and
+reports the response status back to it, so the rate controller sees all the
+traffic. Error statuses raise `HTTPStatusError` instead of being parsed.
+
+Layout of the cache directory:
+    meta/<sha256(url)>.json               validators and body hash of a URL
+    bodies/<sha256(body)>                 raw response bodies
+    parsed/<sha256(body)>.<parser>.json   results of `get_parsed`
+
+With a record directory, every response received (listings, articles and `api.php`
+alike) is also appended to `<record_dir>/responses.jsonl`, with its body stored
+under `<record_dir>/bodies/`, so that `replay_server.py` can serve the crawl again.
+"""
+
+import os
+import json
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Callable, Optional
+from politeness import HostThrottle, host_of
+from metrics import metrics
+
+POOL_SIZE = 16
+TIMEOUT = 30
+
+_local = threading.local()
+_cache = None
+_throttle = None
+_recorder = None
+
+
+class HTTPStatusError(Exception):
+    """ Raised when a server answers with an error status (4xx/5xx). """
+
+    def __init__(self, url: str, status_code: int, retry_after: Optional[str] = None):
+        super().__init__(f"HTTP {status_code} for {url}")
+        self.url = url
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def get_session() -> requests.Session:
+    """ Returns the keep-alive session of the current thread. """
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _local.session = session
+    return session
+
+
+class CachedResponse:
+    """ Minimal response object shared by network and cache hits. """
+
+    def __init__(self, url: str, status_code: int, content: bytes, headers: dict, from_cache: bool = False):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+        self.from_cache = from_cache
+        self.body_hash = hashlib.sha256(content).hexdigest()
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _request(url: str, headers: Optional[dict] = None, stage: str = "fetch") -> requests.Response:
+    """ Sends a GET through the session of the current thread, within the rate limits of the host. """
+    host = host_of(url)
+    if _throttle is not None:
+        _throttle.wait(host)
+    try:
+        with metrics.timer(stage, host=host):
+            r = get_session().get(url, headers=headers, timeout=TIMEOUT)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        metrics.inc("http_requests_total", host=host, status=e.__class__.__name__)
+        if _throttle is not None:
+            _throttle.feedback(host, 503)
+        raise
+    metrics.inc("http_requests_total", host=host, status=r.status_code)
+    metrics.inc("http_bytes_total", len(r.content), host=host)
+    if _recorder is not None and r.status_code != 304:
+        _recorder.record(url, r.status_code, r.headers.get("Content-Type"), r.content)
+    retry_after = r.headers.get("Retry-After")
+    if _throttle is not None:
+        _throttle.feedback(host, r.status_code, retry_after)
+    if r.status_code >= 400:
+        raise HTTPStatusError(url, r.status_code, retry_after)
+    return r
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  # crawlers may share a cache directory
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ResponseCache:
+    """ Content-addressed cache of raw responses, revalidated with conditional GETs. """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        for sub in ("meta", "bodies", "parsed"):
+            os.makedirs(os.path.join(cache_dir, sub), exist_ok=True)
+
+    def _meta_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, "meta", hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _body_path(self, body_hash: str) -> str:
+        return os.path.join(self.cache_dir, "bodies", body_hash)
+
+    def _load(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._meta_path(url), encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(self._body_path(meta["body_hash"]), "rb") as f:
+                meta["content"] = f.read()
+            return meta
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def get(self, url: str, stage: str = "fetch") -> CachedResponse:
+        """ Fetches a URL, sending the stored validators and serving the cached body on 304. """
+        cached = self._load(url)
+        headers = {}
+        if cached is not None:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        r = _request(url, headers, stage)
+        if r.status_code == 304 and cached is not None:
+            return CachedResponse(url, 200, cached["content"], dict(r.headers), from_cache=True)
+
+        response = CachedResponse(url, r.status_code, r.content, dict(r.headers))
+        etag, last_modified = r.headers.get("ETag"), r.headers.get("Last-Modified")
+        # Without validators there is nothing to revalidate, so there is no point in storing it
+        if r.status_code == 200 and (etag or last_modified):
+            body_path = self._body_path(response.body_hash)
+            if not os.path.isfile(body_path):
+                _atomic_write(body_path, response.content)
+            meta = {"url": url, "etag": etag, "last_modified": last_modified, "body_hash": response.body_hash}
+            _atomic_write(self._meta_path(url), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        return response
+
+    def get_parsed(self, url: str, parse_fn: Callable, stage: str = "listing"):
+        """ Returns `parse_fn(content)` for a URL, reusing the stored result if the body did not change. """
+        response = self.get(url, f"{stage}_fetch")
+        parsed_path = os.path.join(self.cache_dir, "parsed", f"{response.body_hash}.{parse_fn.__name__}.json")
+        if os.path.isfile(parsed_path):
+            metrics.inc("parse_cache_hits_total", stage=stage)
+            with open(parsed_path, encoding="utf-8") as f:
+                return json.load(f)
+        with metrics.timer(f"{stage}_parse"):
+            parsed = parse_fn(response.content)
+        _atomic_write(parsed_path, json.dumps(parsed, ensure_ascii=False).encode("utf-8"))
+        return parsed
+
+
+class ResponseRecorder:
+    """ Appends every response received to `responses.jsonl`, with content-addressed bodies. """
+
+    def __init__(self, record_dir: str):
+        self.record_dir = record_dir
+        self.path = os.path.join(record_dir, "responses.jsonl")
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(record_dir, "bodies"), exist_ok=True)
+
+    def record(self, url: str, status_code: int, content_type: Optional[str], content: bytes) -> None:
+        body_hash = hashlib.sha256(content).hexdigest()
+        body_path = os.path.join(self.record_dir, "bodies", body_hash)
+        if not os.path.isfile(body_path):
+            _atomic_write(body_path, content)
+        entry = {"url": url, "status": status_code, "content_type": content_type, "body_hash": body_hash}
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+def configure(cache_dir: Optional[str], throttle: Optional[HostThrottle] = None, record_dir: Optional[str] = None) -> None:
+    """
+    Enables the on-disk response cache (None disables it) and the per-host throttle for all the fetch functions,
+    and optionally the recording of every response in `record_dir`.
+    """
+    global _cache, _throttle, _recorder
+    _cache = ResponseCache(cache_dir) if cache_dir else None
+    _throttle = throttle
+    _recorder = ResponseRecorder(record_dir) if record_dir else None
+
+
+def get(url: str, use_cache: bool = True, stage: str = "fetch") -> CachedResponse:
+    """ Fetches a URL through the pooled session, using the response cache if it is enabled. """
+    if use_cache and _cache is not None:
+        return _cache.get(url, stage)
+    r = _request(url, stage=stage)
+    return CachedResponse(url, r.status_code, r.content, dict(r.headers))
+
+
+def get_parsed(url: str, parse_fn: Callable, stage: str = "listing"):
+    """ Fetches and parses a URL; the parse is skipped when the cached body is still valid. """
+    if _cache is not None:
+        return _cache.get_parsed(url, parse_fn, stage)
+    content = get(url, stage=f"{stage}_fetch").content
+    with metrics.timer(f"{stage}_parse"):
+        return parse_fn(content)
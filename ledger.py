@@ -0,0 +1,189 @@
+"""
+Append-only progress ledger for the crawl frontier stored in `urls.jsonl`.
+
+Instead of rewriting the whole frontier after every article, processed ids are
+appended (and fsync'd) to a small journal next to it, `urls.jsonl.journal`.
+On load the journal is folded back into the frontier in a single pass, and the
+frontier is compacted every now and then so that the journal stays short.
+
+URL discovery uses the same idea: `FrontierWriter` streams the discovered URLs
+to the frontier and `DiscoveryCheckpoint` records which listing pages are done.
+"""
+
+import os
+import json
+import uuid
+import threading
+from typing import List, Optional
+
+
+def _open_append(path: str):
+    """ Opens a journal for appending, dropping a torn last line left by a crash first. """
+    if os.path.isfile(path):
+        with open(path, "r+b") as f:
+            valid_size = sum(len(line) for line in f if line.endswith(b"\n"))
+            f.truncate(valid_size)
+    return open(path, "a", encoding="utf-8")
+
+
+class CrawlLedger:
+    """ In-memory index of the frontier plus a crash-safe journal of processed ids. """
+
+    def __init__(self, urls_path: str, compact_every: int = 1000):
+        self.urls_path = urls_path
+        self.journal_path = urls_path + ".journal"
+        self.compact_every = compact_every
+        self.records = {}  # id -> row, in frontier order
+        self._journal = None
+        self._since_compaction = 0
+        self._lock = threading.Lock()
+
+    def load(self) -> "CrawlLedger":
+        """ Reads the frontier and folds the journal of processed ids into it. """
+        self.records = {}
+        with open(self.urls_path, "rb") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:  # torn last line after a crash during discovery, possibly mid-character
+                    continue
+                self.records[row["id"]] = row
+        replayed = 0
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as f:
+                for line in f:
+                    _id = line.strip()
+                    if _id in self.records:  # a torn last line simply does not match
+                        self.records[_id]["is_processed"] = True
+                        replayed += 1
+        if replayed:
+            self.compact()
+        return self
+
+    def mark_processed(self, _id: str) -> None:
+        """ Marks an article as processed: O(1) in memory plus one small fsync'd append. """
+        with self._lock:
+            self.records[_id]["is_processed"] = True
+            if self._journal is None:
+                self._journal = _open_append(self.journal_path)
+            self._journal.write(_id + "\n")
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._since_compaction += 1
+            if self._since_compaction >= self.compact_every:
+                self._compact()
+
+    def compact(self) -> None:
+        """ Rewrites the frontier with the current state and empties the journal. """
+        with self._lock:
+            self._compact()
+
+    def _compact(self) -> None:
+        tmp_path = self.urls_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in self.records.values():
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.urls_path)
+        # If we crash before truncating, replaying the journal again is harmless.
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, "w", encoding="utf-8")
+        os.fsync(self._journal.fileno())
+        self._since_compaction = 0
+
+    def close(self) -> None:
+        """ Compacts the ledger and releases the journal file. """
+        with self._lock:
+            self._compact()
+            self._journal.close()
+            self._journal = None
+
+    def unique_rows(self) -> List[dict]:
+        """ Returns the rows to crawl, leaving out the URLs flagged as duplicates of another article. """
+        return [row for row in self.records.values() if "duplicate_of" not in row]
+
+    def pending(self) -> List[dict]:
+        """ Returns the rows that have not been processed yet. """
+        return [row for row in self.unique_rows() if not row["is_processed"]]
+
+    def num_processed(self) -> int:
+        return sum(1 for row in self.records.values() if row["is_processed"])
+
+    def num_unprocessed(self) -> int:
+        return len(self.pending())
+
+
+class FrontierWriter:
+    """ Single buffered writer that appends newly discovered URLs to the frontier, skipping known ones. """
+
+    def __init__(self, urls_path: str):
+        self.urls_path = urls_path
+        self.known_urls = set()
+        self._lock = threading.Lock()
+        valid_size = 0
+        if os.path.isfile(urls_path):
+            with open(urls_path, "rb") as f:
+                for line in f:
+                    try:
+                        self.known_urls.add(json.loads(line)["url"])
+                    except ValueError:
+                        break
+                    valid_size += len(line)
+            # Drop a torn last line so that the next append starts on a fresh line
+            with open(urls_path, "r+b") as f:
+                f.truncate(valid_size)
+        self._file = open(urls_path, "a", encoding="utf-8")
+
+    def add(self, lang: str, category: str, page: int, urls: List[str]) -> int:
+        """ Appends the unseen URLs of one listing page and makes them durable; returns how many were new. """
+        with self._lock:
+            num_new = 0
+            for url in urls:
+                if url not in self.known_urls:
+                    self.known_urls.add(url)
+                    row = {"id": str(uuid.uuid4()), "lang": lang, "category": category, "page": page, "is_processed": False, "url": url}
+                    self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    num_new += 1
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            return num_new
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class DiscoveryCheckpoint:
+    """ Append-only journal of the discovery units (listing pages) already completed, with their results. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.units = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # torn last line, possibly mid-character (also a UnicodeDecodeError)
+                        continue
+                    self.units[tuple(entry["unit"])] = entry["result"]
+        self._file = _open_append(path)
+
+    def is_done(self, unit: tuple) -> bool:
+        return unit in self.units
+
+    def result(self, unit: tuple) -> Optional[object]:
+        return self.units.get(unit)
+
+    def done(self, unit: tuple, result: object = None) -> None:
+        """ Marks a unit of work as completed, storing its (JSON-serializable) result. """
+        with self._lock:
+            self.units[unit] = result
+            self._file.write(json.dumps({"unit": list(unit), "result": result}, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
@@ -0,0 +1,293 @@
+"""
+Usage example:
+     python lexical_index.py --data_dir ./output_final --lang es --index_dir ./index_es/lexical
+     python lexical_index.py --index_dir ./index_es/lexical --query "cómo hacer pan" --category comida-y-diversión
+
+BM25 search over the merged corpus (see `merge_categories.py` and `corpus.py`).
+
+Documents are the articles in merged order (document `i` is the i-th record of the shards),
+or their passages with `--unit passages`. The `question`, `introduction` and formatted
+`answers` of every article are indexed with field boosts (term frequencies are weighted by
+field, BM25F-style). Text is lowercased and stripped of accents, except for the ñ, and
+Spanish stopwords are dropped.
+
+The index is a directory of NumPy arrays in CSR layout, memory-mapped at load time:
+
+    vocab.json       terms, the id of a term being its position
+    indptr.npy       int64[num_terms + 1], postings of term t in [indptr[t], indptr[t + 1])
+    doc_ids.npy      int32[num_postings], ascending within each term
+    impacts.npy      float32[num_postings], BM25 term-frequency component (k1, b, length norm)
+    idf.npy          float32[num_terms]
+    categories.npy   int16[num_docs], position of the category of a document in meta.json
+    urls.json        url of every document
+    passages.npy     int32[num_docs, 4], article_id, method_number, char_start, char_end
+                     (only for passages, see `chunking.py`)
+    meta.json        num_docs, avgdl, k1, b, field boosts and category names
+
+Since the length normalization is folded into `impacts`, scoring a query only gathers the
+postings of its terms and sums `idf * impact` per document, for all the queries of a batch
+in one vectorized pass.
+"""
+
+import os
+import re
+import json
+import argparse
+import unicodedata
+import collections
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
+
+import corpus
+from chunking import PASSAGE_FIELDS, passages_prefix
+from formatting import to_example
+
+FIELD_BOOSTS = {"question": 3.0, "introduction": 1.5, "answers": 1.0}
+PASSAGE_BOOSTS = {"question": 1.5, "text": 1.0}
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = {
+    "a", "al", "algo", "algun", "alguna", "algunas", "alguno", "algunos", "ante", "antes", "asi", "aun",
+    "como", "con", "contra", "cual", "cuales", "cuando", "de", "del", "desde", "donde", "dos", "e", "el",
+    "ella", "ellas", "ellos", "en", "entre", "era", "es", "esa", "esas", "ese", "eso", "esos", "esta",
+    "estan", "estas", "este", "esto", "estos", "fue", "ha", "han", "hasta", "hay", "la", "las", "le",
+    "les", "lo", "los", "mas", "me", "mi", "mis", "mucho", "muy", "nada", "ni", "no", "nos", "o", "os",
+    "otra", "otro", "para", "pero", "poco", "por", "porque", "que", "quien", "se", "sea", "ser", "si",
+    "sin", "sobre", "son", "su", "sus", "tambien", "te", "ti", "tu", "tus", "u", "un", "una", "unas",
+    "uno", "unos", "usted", "y", "ya", "yo",
+}
+
+_TOKEN = re.compile(r"\w+")
+_COMBINING = re.compile("[\u0300-\u036f]")
+
+
+def fold(text: str) -> str:
+    """ Lowercases and strips diacritics, keeping the ñ (a letter of its own in Spanish). """
+    text = unicodedata.normalize("NFC", text).lower().replace("\u00f1", "\0")
+    text = _COMBINING.sub("", unicodedata.normalize("NFD", text))
+    return text.replace("\0", "\u00f1")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(fold(text)) if token not in STOPWORDS]
+
+
+def field_text(doc: dict, field: str) -> str:
+    value = doc.get(field) or ""
+    return "\n".join(value) if isinstance(value, list) else value
+
+
+def iter_documents(index_file: str) -> Iterator[dict]:
+    """ Yields the articles of a merged corpus as dataset examples, in merged order. """
+    for record in corpus.iter_records(index_file):
+        yield to_example(record)
+
+
+def build_index(docs: Iterable[dict], index_dir: str, boosts: Dict[str, float] = FIELD_BOOSTS,
+                k1: float = K1, b: float = B) -> dict:
+    """ Indexes documents with the fields of `boosts` plus `url` and `category`; returns the metadata. """
+    os.makedirs(index_dir, exist_ok=True)
+    vocab, urls, category_names = {}, [], {}
+    term_ids, doc_ids, tfs = array("i"), array("i"), array("f")
+    doc_lengths, doc_categories = array("f"), array("h")
+    passages = array("i")
+    for doc_id, doc in enumerate(docs):
+        counts = collections.Counter()
+        for field, boost in boosts.items():
+            for token in tokenize(field_text(doc, field)):
+                counts[token] += boost
+        for token, tf in counts.items():
+            term_ids.append(vocab.setdefault(token, len(vocab)))
+            doc_ids.append(doc_id)
+            tfs.append(tf)
+        doc_lengths.append(sum(counts.values()))
+        doc_categories.append(category_names.setdefault(doc.get("category") or "", len(category_names)))
+        urls.append(doc.get("url"))
+        if "article_id" in doc:
+            passages.extend(doc[field] for field in PASSAGE_FIELDS)
+
+    num_docs, num_terms = len(urls), len(vocab)
+    term_ids = np.frombuffer(term_ids, dtype=np.int32)
+    doc_ids = np.frombuffer(doc_ids, dtype=np.int32)
+    tfs = np.frombuffer(tfs, dtype=np.float32)
+    doc_lengths = np.frombuffer(doc_lengths, dtype=np.float32)
+    avgdl = float(doc_lengths.mean()) if num_docs else 0.0
+
+    # Stable sort by term keeps the documents of every posting list in ascending order
+    order = np.argsort(term_ids, kind="stable")
+    doc_ids, tfs = doc_ids[order], tfs[order]
+    df = np.bincount(term_ids, minlength=num_terms)
+    indptr = np.zeros(num_terms + 1, dtype=np.int64)
+    np.cumsum(df, out=indptr[1:])
+    norm = k1 * (1 - b + b * doc_lengths[doc_ids] / max(avgdl, 1e-9))
+    impacts = (tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+    idf = np.log(1 + (num_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    np.save(os.path.join(index_dir, "indptr.npy"), indptr)
+    np.save(os.path.join(index_dir, "doc_ids.npy"), doc_ids)
+    np.save(os.path.join(index_dir, "impacts.npy"), impacts)
+    np.save(os.path.join(index_dir, "idf.npy"), idf)
+    np.save(os.path.join(index_dir, "categories.npy"), np.frombuffer(doc_categories, dtype=np.int16))
+    if passages:
+        np.save(os.path.join(index_dir, "passages.npy"), np.frombuffer(passages, dtype=np.int32).reshape(-1, len(PASSAGE_FIELDS)))
+    elif os.path.exists(os.path.join(index_dir, "passages.npy")):
+        os.remove(os.path.join(index_dir, "passages.npy"))
+    with open(os.path.join(index_dir, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump(sorted(vocab, key=vocab.get), f, ensure_ascii=False)
+    meta = {
+        "num_docs": num_docs,
+        "num_terms": num_terms,
+        "num_postings": int(len(doc_ids)),
+        "avgdl": avgdl,
+        "k1": k1,
+        "b": b,
+        "boosts": boosts,
+        "categories": sorted(category_names, key=category_names.get),
+    }
+    return write_metadata(index_dir, urls, meta)
+
+
+def write_metadata(index_dir: str, urls: List[str], meta: dict) -> dict:
+    """ Writes the urls and the metadata of an index; meta.json goes last, an index directory without it being incomplete. """
+    with open(os.path.join(index_dir, "urls.json"), "w", encoding="utf-8") as f:
+        json.dump(urls, f, ensure_ascii=False)
+    with open(os.path.join(index_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def print_hits(queries: List[str], results: List[List[dict]]) -> None:
+    """ Prints the hits of a batch of queries, articles or passages. """
+    for query, hits in zip(queries, results):
+        print(f"\n{query}")
+        for hit in hits:
+            passage = f" method {hit['method_number']} [{hit['char_start']}:{hit['char_end']}]" if "article_id" in hit else ""
+            print(f"  {hit['score']:7.3f}  [{hit['category']}] {hit['url']}{passage}")
+
+
+class LexicalIndex:
+    """ Memory-mapped BM25 index written by `build_index`. """
+
+    def __init__(self, index_dir: str):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(index_dir, "vocab.json"), encoding="utf-8") as f:
+            self.vocab = {term: i for i, term in enumerate(json.load(f))}
+        with open(os.path.join(index_dir, "urls.json"), encoding="utf-8") as f:
+            self.urls = json.load(f)
+        load = lambda name: np.load(os.path.join(index_dir, name), mmap_mode="r")
+        self.indptr = load("indptr.npy")
+        self.doc_ids = load("doc_ids.npy")
+        self.impacts = load("impacts.npy")
+        self.idf = load("idf.npy")
+        self.doc_categories = load("categories.npy")
+        self.passages = load("passages.npy") if os.path.exists(os.path.join(index_dir, "passages.npy")) else None
+        self.category_codes = {c.lower(): i for i, c in enumerate(self.meta["categories"])}
+        self.num_docs = self.meta["num_docs"]
+
+    def _category_code(self, category: Optional[str]) -> Optional[int]:
+        if category in (None, "all"):
+            return None
+        return self.category_codes.get(category.lower(), -1)  # unknown category: no results
+
+    def search(self, query: str, k: int = 10, category: Optional[str] = None) -> List[dict]:
+        return self.search_batch([query], k, category)[0]
+
+    def _postings(self, query: str, code: Optional[int]):
+        """ Yields the (documents, scores) of every known term of a query. """
+        for term, count in collections.Counter(tokenize(query)).items():
+            t = self.vocab.get(term)
+            if t is None:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs, impacts = self.doc_ids[start:end], self.impacts[start:end]
+            if code is not None:
+                mask = self.doc_categories[docs] == code
+                docs, impacts = docs[mask], impacts[mask]
+            yield docs, impacts * (self.idf[t] * count)
+
+    def _hits(self, docs: np.ndarray, scores: np.ndarray, k: int) -> List[dict]:
+        """ Top-k of the scored candidates, best first (ties broken by document id). """
+        if len(docs) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            docs, scores = docs[top], scores[top]
+        hits = []
+        for i in np.lexsort((docs, -scores)):
+            hit = {
+                "doc_id": int(docs[i]),
+                "score": float(scores[i]),
+                "url": self.urls[docs[i]],
+                "category": self.meta["categories"][self.doc_categories[docs[i]]],
+            }
+            if self.passages is not None:
+                hit.update(zip(PASSAGE_FIELDS, map(int, self.passages[docs[i]])))
+            hits.append(hit)
+        return hits
+
+    def search_batch(self, queries: List[str], k: int = 10,
+                     category: Union[None, str, List[Optional[str]]] = None) -> List[List[dict]]:
+        """
+        Returns the top-k documents of every query, as {doc_id, score, url, category} dicts
+        (plus the `PASSAGE_FIELDS` of passage indexes).
+
+        `category` filters all the queries, or each one if it is a list. Queries with short
+        posting lists are scored together, keyed by (query, document); queries that touch a
+        large part of the corpus get a dense accumulator of their own.
+        """
+        categories = category if isinstance(category, list) else [category] * len(queries)
+        results = [[] for _ in queries]
+        if k <= 0:
+            return results
+        keys, sparse_scores = [], []
+        for q, query in enumerate(queries):
+            postings = list(self._postings(query, self._category_code(categories[q])))
+            if sum(len(docs) for docs, _ in postings) * 8 > self.num_docs:
+                totals = np.zeros(self.num_docs, dtype=np.float32)
+                for docs, scores in postings:
+                    totals[docs] += scores  # documents are unique within a posting list
+                matched = np.flatnonzero(totals)
+                results[q] = self._hits(matched, totals[matched], k)
+            else:
+                for docs, scores in postings:
+                    keys.append(q * self.num_docs + docs.astype(np.int64))
+                    sparse_scores.append(scores)
+        if keys:
+            keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+            totals = np.bincount(inverse, weights=np.concatenate(sparse_scores))
+            bounds = np.searchsorted(keys, np.arange(len(queries) + 1, dtype=np.int64) * self.num_docs)
+            for q in range(len(queries)):
+                start, end = bounds[q], bounds[q + 1]
+                if start < end:
+                    results[q] = self._hits(keys[start:end] - q * self.num_docs, totals[start:end], k)
+        return results
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_dir', default='./output_final', type=str, help='Directory of the merged corpus')
+    parser.add_argument('-l', '--lang', default='es', type=str)
+    parser.add_argument('-i', '--index_dir', default='./index_es/lexical', type=str)
+    parser.add_argument('-u', '--unit', default='articles', choices=['articles', 'passages'], help='Index whole articles or the passages of chunking.py')
+    parser.add_argument('-q', '--query', action='append', help='Query the index instead of building it (repeatable)')
+    parser.add_argument('-c', '--category', default=None, type=str)
+    parser.add_argument('-k', '--top_k', default=10, type=int)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.query:
+        index = LexicalIndex(args.index_dir)
+        print_hits(args.query, index.search_batch(args.query, args.top_k, args.category))
+    else:
+        print(args)
+        if args.unit == "passages":
+            docs = corpus.iter_records(corpus.index_path(args.data_dir, passages_prefix(args.lang)))
+            meta = build_index(docs, args.index_dir, PASSAGE_BOOSTS)
+        else:
+            meta = build_index(iter_documents(corpus.index_path(args.data_dir, f"wikihow_{args.lang}")), args.index_dir)
+        print(f"Indexed {meta['num_docs']} documents, {meta['num_terms']} terms and {meta['num_postings']} postings in {args.index_dir}")
@@ -4,6 +4,9 @@ Usage example:
 
 This would retrieve 50 articles from each category of the Spanish and Portuguese
 WikiHow websites and store their contents in a directory called `my_wikihow_articles`.
+
+Adding `--refresh` to a later run refetches only the articles whose revision changed
+since they were crawled, and crawls the ones published in the meantime.
 """
 
 import os
@@ -11,16 +14,23 @@ import re
 import csv
 import bs4
 import time
+import socket
+import itertools
 import json
-import uuid
 import pprint
 import datetime
 import argparse
-import requests
 import collections
 import wikihowunofficialapi
+import http_cache
 import pandas as pd
-from typing import List
+from typing import Callable, List
+from ledger import CrawlLedger, DiscoveryCheckpoint, FrontierWriter
+from frontier import SQLiteFrontier
+from politeness import AdaptiveThrottle, host_of, run_by_host
+from mediawiki import PageInfoCache, resolve_pages
+from retry_queue import FailureQueue, is_transient
+from metrics import metrics
 
 # Home page and important keywords for every language-specigic WikiHow site
 languages = {
@@ -48,71 +58,239 @@ languages = {
 def parse_args() -> argparse.Namespace:
     """ Parses command-line arguments. """
     parser = argparse.ArgumentParser()
-    parser.add_argument('-l', '--langs', default='es', nargs='*', choices=list(languages.keys()))
+    parser.add_argument('-l', '--langs', default=['es'], nargs='*', choices=list(languages.keys()))
     parser.add_argument('-o', '--out_dir', default='./output', type=str)
     parser.add_argument('-m', '--max_per_category', default=-1, type=int)
-    parser.add_argument('-d', '--delay', default=5, type=int)
+    parser.add_argument('-d', '--delay', default=5, type=float, help='Initial seconds between two requests to the same host')
+    parser.add_argument('--min_delay', default=3, type=float, help='Shortest interval the rate controller may reach on a healthy host')
+    parser.add_argument('-r', '--refresh', action='store_true', help='Refetch the crawled articles whose revision changed and crawl new ones')
+    parser.add_argument('-c', '--cache_dir', default=None, type=str, help='On-disk HTTP cache (default: <out_dir>/http_cache)')
+    parser.add_argument('--metrics_interval', default=60, type=float, help='Seconds between two exports of metrics.jsonl/metrics.prom')
+    parser.add_argument('--record_dir', default=None, type=str, help='Record every response received, for replay_server.py')
+    parser.add_argument('--frontier', default='jsonl', choices=['jsonl', 'sqlite'], help='sqlite: share <out_dir>/frontier.db with other workers (see frontier.py)')
+    parser.add_argument('--worker_id', default=f"{socket.gethostname()}-{os.getpid()}", type=str, help='Name of this worker in a shared frontier')
+    parser.add_argument('--lease_seconds', default=600, type=float, help='Seconds after which the articles claimed by a dead worker are claimed again')
+    parser.add_argument('--claim_size', default=20, type=int, help='Articles claimed at once from a shared frontier')
+    parser.add_argument('--base_url', default=[], action='append', metavar='LANG=URL', help='Crawl a language from another server (e.g. es=http://127.0.0.1:8000)')
     return parser.parse_args()
 
 def get_id(url_addr:str) -> str:
     """ Returns the article ID given a URL. """
-    _home_page = "https://" + url_addr.split("https://")[1].split("/")[0] + "/"
-    site = url_addr.replace(_home_page, '')
-    r = requests.get(f"{_home_page}api.php?format=json&action=query&prop=info&titles={site}")
-    _pages = r.json()['query']['pages']
-    for key in _pages.keys():
-        article_id = _pages[key]['pageid']
-    return article_id
+    return resolve_pages([url_addr])[url_addr]['pageid']
 
-def get_categories(language: str) -> List[str]:
-    """ Returns a list of categories available in a language-specific WikiHow website. """
-    home_page, special_trans, _ = languages[language]
-    url_categories = requests.get(f"{home_page}/{special_trans}:CategoryListing")
-    categories_soup = bs4.BeautifulSoup(url_categories.content, "html.parser")
+def parse_categories(html: bytes) -> List[str]:
+    """ Extracts the list of categories from a CategoryListing page. """
+    categories_soup = bs4.BeautifulSoup(html, "html.parser")
     categories_list = categories_soup.find_all("a", {"id": re.compile('cat_list_.*')})
     categories_list = [cat.text.replace(" ", "-") for cat in categories_list]
     return categories_list
 
-def get_num_pages(language: str, category_name: str) -> int:
-    """ Returns the number of pages in the given category. """
-    home_page, _, category_trans = languages[language]
-    cat_page = requests.get(f"{home_page}/{category_trans}:{category_name}")
-    soup = bs4.BeautifulSoup(cat_page.content, "html.parser")
+def get_categories(language: str) -> List[str]:
+    """ Returns a list of categories available in a language-specific WikiHow website. """
+    home_page, special_trans, _ = languages[language]
+    return http_cache.get_parsed(f"{home_page}/{special_trans}:CategoryListing", parse_categories, stage="listing")
+
+def parse_num_pages(html: bytes) -> int:
+    """ Extracts the number of pages from the first page of a category. """
+    soup = bs4.BeautifulSoup(html, "html.parser")
     pages = soup.find_all("ul", class_="pagination")
     total_pages = len(pages[0].find_all("li")) if pages else 1
     return total_pages
 
-def get_urls(language: str, category_name: str, page_number: int) -> List[str]:
-    """ Returns a list of URLs for the given page and category. """
+def get_num_pages(language: str, category_name: str) -> int:
+    """ Returns the number of pages in the given category. """
     home_page, _, category_trans = languages[language]
-    curr_page = requests.get(f"{home_page}/{category_trans}:{category_name}?pg={page_number}")
-    soup = bs4.BeautifulSoup(curr_page.content, "html.parser")
+    return http_cache.get_parsed(f"{home_page}/{category_trans}:{category_name}", parse_num_pages, stage="listing")
+
+def parse_urls(html: bytes) -> List[str]:
+    """ Extracts the article URLs listed in a category page. """
+    soup = bs4.BeautifulSoup(html, "html.parser")
     responsive_thumbs = soup.find_all("div", class_="responsive_thumb")
     urls_list = [responsive_thumb.find("a", href=True)["href"] for responsive_thumb in responsive_thumbs]
     return urls_list
 
-def generate_urls_file(langs: List[str], out_dir: str) -> None:
-    print(f"Storing all URL addresses in {out_dir}/urls.jsonl...")
-    set_of_urls = set()
-    for _lang in langs:
-        _categories = get_categories(_lang)
+def get_urls(language: str, category_name: str, page_number: int) -> List[str]:
+    """ Returns a list of URLs for the given page and category. """
+    home_page, _, category_trans = languages[language]
+    return http_cache.get_parsed(f"{home_page}/{category_trans}:{category_name}?pg={page_number}", parse_urls, stage="listing")
+
+def with_retries(fetch: Callable, *args, attempts: int = 5):
+    """ Calls `fetch(*args)`, retrying transient errors; the throttle has already slowed the host down by then. """
+    for attempt in range(1, attempts + 1):
+        try:
+            return fetch(*args)
+        except Exception as e:
+            if attempt == attempts or not is_transient(e):
+                raise
+            print(f"\tTransient error ({e}), retrying...")
+            time.sleep(min(60, 2 ** (attempt - 1)))
+
+def generate_urls_file(langs: List[str], out_dir: str, restart: bool = False) -> None:
+    """
+    Discovers the article URLs of every category page and streams them to `urls.jsonl`.
+
+    Every listing page is a unit of work that gets checkpointed in `discovery.jsonl` once its URLs
+    are in the frontier, so an interrupted discovery resumes where it stopped. Languages are
+    discovered in parallel, each one within the politeness limits of its own host.
+    """
+    urls_path = os.path.join(out_dir, "urls.jsonl")
+    checkpoint_path = os.path.join(out_dir, "discovery.jsonl")
+    if restart and os.path.isfile(checkpoint_path):
+        os.remove(checkpoint_path)
+    elif os.path.isfile(urls_path) and not os.path.isfile(checkpoint_path):
+        return  # frontier generated before discovery was checkpointed
+
+    checkpoint = DiscoveryCheckpoint(checkpoint_path)
+    pending = {host_of(languages[_lang][0]): _lang for _lang in langs if not checkpoint.is_done(("complete", _lang))}
+    if not pending:
+        checkpoint.close()
+        return
+
+    print(f"Storing all URL addresses in {urls_path}...")
+    frontier = FrontierWriter(urls_path)
+
+    def discover_host(host: str, _lang: str) -> None:
+        _categories = checkpoint.result(("categories", _lang))
+        if _categories is None:
+            _categories = with_retries(get_categories, _lang)
+            checkpoint.done(("categories", _lang), _categories)
         for _category in _categories:
-            _npages = get_num_pages(_lang, _category)
+            _npages = checkpoint.result(("num_pages", _lang, _category))
+            if _npages is None:
+                _npages = with_retries(get_num_pages, _lang, _category)
+                checkpoint.done(("num_pages", _lang, _category), _npages)
             for _page in range(1, _npages+1):
-                _urls = get_urls(_lang, _category, _page)
-                urls_file = open(os.path.join(out_dir, "urls.jsonl"), "a")
-                for _url in _urls:
-                    if _url not in set_of_urls:
-                        set_of_urls.add(_url)
-                        _id = uuid.uuid4().__str__()
-                        _row = {"id": _id, "lang": _lang, "category": _category, "page": _page, "is_processed": False, "url": _url}
-                        urls_file.writelines([json.dumps(_row, ensure_ascii=False), "\n"])
+                if checkpoint.is_done(("listing", _lang, _category, _page)):
+                    continue
+                _urls = with_retries(get_urls, _lang, _category, _page)
+                _new = frontier.add(_lang, _category, _page, _urls)
+                checkpoint.done(("listing", _lang, _category, _page))
+                print(f"\tPage {_page}/{_npages} of {_category} from WIKI-HOW-{_lang.upper()}: {_new} new URLs")
+        checkpoint.done(("complete", _lang))
+
+    try:
+        run_by_host(pending, discover_host)
+    finally:
+        frontier.close()
+        checkpoint.close()
     print("Done!")
 
+def dedup_frontier(ledger: CrawlLedger, id_cache: PageInfoCache) -> None:
+    """
+    Resolves the page IDs of the frontier in bulk and flags the URLs pointing to an article already in it.
+
+    Duplicates stay in the frontier (with `duplicate_of`, and are never crawled) so that a later
+    discovery knows them and does not add and resolve them again.
+    """
+    unresolved = [row["url"] for row in ledger.records.values() if "pageid" not in row]
+    if not unresolved:
+        return
+    print(f"Resolving the page IDs of {len(unresolved)} URLs...")
+    # Batches resolved before a failure are in the cache, so a retry only queries the rest
+    infos = with_retries(resolve_pages, unresolved, id_cache)
+    seen, num_duplicates = {}, 0
+    for _id, row in ledger.records.items():
+        if "duplicate_of" in row:
+            continue
+        if "pageid" not in row:
+            info = infos.get(row["url"]) or {}
+            row["pageid"] = info.get("pageid")
+            row["lastrevid"] = info.get("lastrevid")
+        if row["pageid"] is not None:
+            key = (row["lang"], row["pageid"])
+            if key in seen:
+                row["duplicate_of"] = seen[key]
+                num_duplicates += 1
+            else:
+                seen[key] = _id
+    ledger.compact()
+    print(f"Flagged {num_duplicates} duplicated URLs in the frontier.")
+
+def read_category_files(langs: List[str], out_dir: str) -> dict:
+    """ Returns {lang: [path, ...]} with the per-category output files already written for each language. """
+    files = collections.defaultdict(list)
+    for filename in sorted(os.listdir(out_dir)):
+        if not (filename.startswith("wikihow_") and filename.endswith(".jsonl")):
+            continue
+        parts = filename[len("wikihow_"):-len(".jsonl")].split("_", 1)
+        if len(parts) == 2 and parts[0] in langs:
+            files[parts[0]].append(os.path.join(out_dir, filename))
+    return files
+
+def refresh_corpus(langs: List[str], out_dir: str, id_cache: PageInfoCache) -> None:
+    """ Refetches the already crawled articles whose revision changed, keeping the others as they are. """
+    files = read_category_files(langs, out_dir)
+    stored = {}
+    for paths in files.values():
+        for path in paths:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        stored[record["url"]] = record.get("revid")
+    print(f"Checking the current revision of {len(stored)} articles...")
+    current = resolve_pages(stored.keys(), cache=id_cache, refresh=True)
+    changed = {url for url, revid in stored.items() if current.get(url) and current[url]["lastrevid"] != revid}
+    print(f"{len(changed)} articles changed since they were crawled.")
+
+    def refresh_host(host: str, host_paths: List[str]) -> None:
+        for path in host_paths:
+            with open(path, encoding="utf-8") as f:
+                lines = [line for line in f if line.strip()]
+            num_updated = 0
+            for k, line in enumerate(lines):
+                url = json.loads(line)["url"]
+                if url not in changed:
+                    continue
+                try:
+                    processed_article = process_article(url)
+                    processed_article["pageid"] = current[url]["pageid"]
+                    processed_article["revid"] = current[url]["lastrevid"]
+                    lines[k] = json.dumps(processed_article, ensure_ascii=False) + "\n"
+                    num_updated += 1
+                except Exception as e:
+                    print(f"\tError: Could not refresh {url} ({e.__class__.__name__})")
+            if num_updated:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    f.writelines(lines)
+                os.replace(path + ".tmp", path)
+                print(f"\tRefreshed {num_updated} articles in {path}")
+
+    run_by_host({host_of(languages[lang][0]): paths for lang, paths in files.items()}, refresh_host)
+
+def parse_article(url_addr: str, html: bytes) -> dict:
+    """ Parses the HTML of an article with the parsers of `wikihowunofficialapi`, without fetching it again. """
+    article = wikihowunofficialapi.Article(url_addr)
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    try:
+        # Same sequence as `Article._parse`, minus the download
+        article._parse_title(soup)
+        article._parse_intro(soup)
+        article._parse_methods(soup)
+        article._parse_votes_n_helpful(soup)
+        article._parse_is_expert(soup)
+        article._parse_last_updated(soup)
+        article._parse_views(soup)
+        article._parse_co_authors(soup)
+        article._parse_references(soup)
+        article._parse_summary(soup)
+        article._parse_warnings(soup)
+        article._parse_tips(soup)
+    except Exception:
+        raise wikihowunofficialapi.ParseError
+    article._parsed = True
+    return article.get()
+
 def process_article(url_addr: str) -> dict:
     """ Processes the article from a given URL and returns a dictionary with its content and some metadata. """
-    article = wikihowunofficialapi.Article(url_addr).get()
+    html = http_cache.get(url_addr, use_cache=False, stage="article_fetch").content
+    with metrics.timer("article_parse"):
+        article = parse_article(url_addr, html)
+    with metrics.timer("transform"):
+        return transform_article(article)
 
+def transform_article(article: dict) -> dict:
+    """ Keeps the content and metadata we need from an article parsed by `wikihowunofficialapi`. """
     methods = []
     for method in article["methods"]:
         steps = []
@@ -143,51 +321,196 @@ def process_article(url_addr: str) -> dict:
     }
     return processed
 
+def output_path(out_dir: str, lang: str, category: str) -> str:
+    return f"{out_dir}/wikihow_{lang}_{category.lower()}.jsonl"
+
+def crawl_article(row: dict, out_file, ledger: CrawlLedger, failures: FailureQueue, counts: dict, tag: str) -> None:
+    """ Processes one article of the frontier, recording it in the ledger or in the failure queue. """
+    try:
+        processed_article = process_article(row["url"])
+        processed_article["pageid"] = row.get("pageid")
+        processed_article["revid"] = row.get("lastrevid")
+        with metrics.timer("serialize"):
+            out_file.writelines([json.dumps(processed_article, ensure_ascii=False), "\n"])
+            out_file.flush()
+        print(f"\t{tag}) Processed: [{row['id']}] {processed_article['title']}")
+
+        with metrics.timer("ledger_write"):
+            ledger.mark_processed(row["id"])
+            failures.record_success(row["id"])
+        metrics.inc("articles_processed_total", host=host_of(row["url"]), lang=row["lang"], category=row["category"])
+
+        if row["category"] in counts[row["lang"]]:
+            counts[row["lang"]][row["category"]] += 1
+        else:
+            counts[row["lang"]][row["category"]] = 1
+
+    except Exception as e:
+        metrics.inc("articles_failed_total", host=host_of(row["url"]), lang=row["lang"], category=row["category"], error=e.__class__.__name__)
+        entry = failures.record_failure(row, e)
+        outcome = "dead-lettered" if entry["dead"] else f"will retry (attempt {entry['attempts']})"
+        print(f"\t{tag}) Error: Could not process {row['url']} ({e.__class__.__name__}: {e}), {outcome}")
+
+def process_category(df: pd.DataFrame, out_dir: str, ledger: CrawlLedger, failures: FailureQueue, counts: dict) -> None:
+    """ Processes all pending articles of a single (language, category) group. """
+    with open(output_path(out_dir, df['lang'].iloc[0], df['category'].iloc[0]), 'a') as out_file:
+        for j, _id in enumerate(df["id"], 1):
+            row = ledger.records[_id]
+            if failures.is_dead(row) or failures.is_deferred(row):
+                continue  # dead articles are skipped, deferred ones wait for `retry_failures`
+            crawl_article(row, out_file, ledger, failures, counts, f"{j}/{df.shape[0]}")
+
+def retry_failures(lang: str, out_dir: str, ledger: CrawlLedger, failures: FailureQueue, counts: dict) -> None:
+    """ Retries the transient failures of a language as their backoff expires, until they succeed or die. """
+    while True:
+        pending = failures.pending(lang)
+        if not pending:
+            return
+        entry = pending[0]
+        time.sleep(max(0.0, entry["next_eligible"] - time.time()))
+        row = ledger.records.get(entry["id"])
+        if row is None or row["is_processed"]:
+            failures.record_success(entry["id"])
+            continue
+        with open(output_path(out_dir, row["lang"], row["category"]), 'a') as out_file:
+            crawl_article(row, out_file, ledger, failures, counts, f"retry {entry['attempts']+1}")
+
+def revive_dead_letters(ledger: CrawlLedger, failures: FailureQueue, id_cache: PageInfoCache) -> None:
+    """ Gives another chance to the dead-lettered articles whose page changed since they failed. """
+    dead = {_id: e for _id, e in failures.dead().items() if _id in ledger.records}
+    current = resolve_pages([e["url"] for e in dead.values()], cache=id_cache, refresh=True)
+    for _id, entry in dead.items():
+        info = current.get(entry["url"])
+        if info and info["lastrevid"] != entry["revid"]:
+            ledger.records[_id]["lastrevid"] = info["lastrevid"]
+            failures.revive(_id)
+
+def crawl_leased(langs: List[str], frontier: SQLiteFrontier, out_dir: str, counts: dict, claim_size: int) -> None:
+    """ Crawls the articles of some languages by claiming batches of them from a shared frontier, until none is left. """
+    while True:
+        rows = frontier.claim(langs, claim_size)
+        if not rows:
+            next_eligible = frontier.next_eligible(langs)
+            if next_eligible is None:
+                return
+            time.sleep(min(max(next_eligible - time.time(), 1.0), 30.0))  # leased by others, or backing off
+            continue
+        for (lang, category), group in itertools.groupby(rows, key=lambda row: (row["lang"], row["category"])):
+            with open(output_path(out_dir, lang, category), 'a') as out_file:
+                for row in group:
+                    # The frontier also stands in for the failure queue: attempts are shared by all the workers
+                    crawl_article(row, out_file, frontier, frontier, counts, f"{lang}.{category}")
+
+def revive_dead_articles(frontier: SQLiteFrontier, lang: str, id_cache: PageInfoCache) -> None:
+    """ Same as `revive_dead_letters`, for the dead articles of a language in a shared frontier. """
+    dead = {_id: row for _id, row in frontier.dead().items() if row["lang"] == lang}
+    current = resolve_pages([row["url"] for row in dead.values()], cache=id_cache, refresh=True)
+    for _id, row in dead.items():
+        info = current.get(row["url"])
+        if info and info["lastrevid"] != row["lastrevid"]:
+            frontier.revive(_id, info["lastrevid"])
+
 if __name__ == "__main__":
     start_time = time.time()
 
     args = parse_args()
     print(args)
 
-    if not os.path.exists(args.out_dir):
-        os.makedirs(args.out_dir)
+    for override in args.base_url:
+        _lang, _, _url = override.partition("=")
+        languages[_lang] = (_url.rstrip("/"),) + languages[_lang][1:]
 
-    URLS_FILE_PATH = os.path.join(args.out_dir,"urls.jsonl")
-    if not os.path.isfile(URLS_FILE_PATH):
-        generate_urls_file(args.langs, args.out_dir)
+    # With a shared frontier, every worker keeps its outputs, failures and metrics apart (see frontier.py)
+    work_dir = os.path.join(args.out_dir, "workers", args.worker_id) if args.frontier == "sqlite" else args.out_dir
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+
+    METRICS_PATHS = (os.path.join(work_dir, "metrics.jsonl"), os.path.join(work_dir, "metrics.prom"))
+    metrics.start_exporter(*METRICS_PATHS, interval=args.metrics_interval)
+
+    # Every request goes through the same per-host rate controller, which adapts to the server responses
+    throttle = AdaptiveThrottle(args.delay, args.min_delay)
+    http_cache.configure(args.cache_dir or os.path.join(args.out_dir, "http_cache"), throttle, args.record_dir)
 
-    df_all = pd.read_json(URLS_FILE_PATH, lines=True)
-    dfs    = [elem.loc[~elem['is_processed']] for _,elem in df_all.groupby(["lang","category"])]
+    URLS_FILE_PATH = os.path.join(args.out_dir,"urls.jsonl")
+    failures = FailureQueue(work_dir)
     counts = collections.defaultdict(dict)
 
-    for i,df in enumerate(dfs,1):
-        if df.shape[0] == 0:
-            continue
-        if args.max_per_category>0:
-            df = df.head(args.max_per_category)
-        print(f"Processing category {i}/{len(dfs)}.{df['category'].iloc[0]} from WIKI-HOW-{df['lang'].iloc[0].upper()}...")
-        out_filename = f"{args.out_dir}/wikihow_{df['lang'].iloc[0]}_{df['category'].iloc[0].lower()}.jsonl"
-        out_file = open(out_filename, 'a')
-        for j, row in enumerate(df.itertuples(), 1):
-            time.sleep(args.delay)  # to prevent being banned
-            try:
-                processed_article = process_article(row.url)
-                out_file.writelines([json.dumps(processed_article, ensure_ascii=False), "\n"])
-                print(f"\t{j}/{df.shape[0]}) Processed: [{row.id}] {processed_article['title']}")
-
-                df_all.loc[df_all["id"]==row.id, "is_processed"] = True
-                with open(URLS_FILE_PATH, "w") as f:
-                    f.write(df_all.to_json(orient="records", lines=True, force_ascii=False))
-
-                if row.category in counts[row.lang]:
-                    counts[row.lang][row.category] += 1
-                else:
-                    counts[row.lang][row.category] = 1
-
-            except:
-                print(f"\t{j}/{df.shape[0]}) Error: Could not process {row.url}")
+    if args.frontier == "sqlite":
+        if args.max_per_category > 0:
+            print("Warning: --max_per_category is ignored with a shared frontier.")
+        ledger = SQLiteFrontier(os.path.join(args.out_dir, "frontier.db"), args.worker_id, args.lease_seconds,
+                                retry_schedule=failures.schedule)
+        for lang in args.langs:
+            # Every language is discovered in a directory of its own, under a lock of its own: the first worker
+            # runs the discovery, the next ones only add what is new, and workers of other languages do not wait
+            lang_dir = os.path.join(args.out_dir, "discovery", lang)
+            os.makedirs(lang_dir, exist_ok=True)
+            with ledger.lock(f"discovery_{lang}"):
+                generate_urls_file([lang], lang_dir, restart=args.refresh)
+                id_cache = PageInfoCache(os.path.join(lang_dir, "page_ids.jsonl"))
+                urls_ledger = CrawlLedger(os.path.join(lang_dir, "urls.jsonl")).load()
+                dedup_frontier(urls_ledger, id_cache)
+                urls_ledger.close()
+                if args.refresh:
+                    refresh_corpus([lang], args.out_dir, id_cache)
+                    revive_dead_articles(ledger, lang, id_cache)
+                print(f"Added {ledger.import_rows(urls_ledger.unique_rows())} URLs of WIKI-HOW-{lang.upper()} to {ledger.db_path}")
+
+        langs_by_host = collections.defaultdict(list)
+        for lang in args.langs:
+            langs_by_host[host_of(languages[lang][0])].append(lang)
+
+        def crawl_host(host: str, host_langs: List[str]) -> None:
+            print(f"Worker {args.worker_id} crawling {host}...")
+            crawl_leased(host_langs, ledger, work_dir, counts, args.claim_size)
+
+        run_by_host(langs_by_host, crawl_host)
+        dead_letters, dead_letter_source = ledger.dead(), f"python frontier.py --out_dir {args.out_dir} status"
+
+    else:
+        # On --refresh, listings are walked again to find new articles; unchanged ones are mostly 304s
+        generate_urls_file(args.langs, args.out_dir, restart=args.refresh)
+
+        id_cache = PageInfoCache(os.path.join(args.out_dir, "page_ids.jsonl"))
+        ledger = CrawlLedger(URLS_FILE_PATH).load()
+        dedup_frontier(ledger, id_cache)
+        if args.refresh:
+            refresh_corpus(args.langs, args.out_dir, id_cache)
+            revive_dead_letters(ledger, failures, id_cache)
+        df_all = pd.DataFrame(ledger.unique_rows())
+        dfs    = [elem.loc[~elem['is_processed']] for _,elem in df_all.groupby(["lang","category"])]
+
+        # Every language site is a different host: hosts are crawled in parallel, each one at its own pace
+        dfs_by_host = collections.defaultdict(list)
+        for i,df in enumerate(dfs,1):
+            if df.shape[0] == 0:
+                continue
+            if args.max_per_category>0:
+                df = df.head(args.max_per_category)
+            dfs_by_host[host_of(languages[df['lang'].iloc[0]][0])].append((i, df))
+
+        for lang in args.langs:
+            if failures.pending(lang):
+                dfs_by_host.setdefault(host_of(languages[lang][0]), [])
+
+        def crawl_host(host: str, host_dfs: list) -> None:
+            for i, df in host_dfs:
+                print(f"Processing category {i}/{len(dfs)}.{df['category'].iloc[0]} from WIKI-HOW-{df['lang'].iloc[0].upper()}...")
+                process_category(df, args.out_dir, ledger, failures, counts)
+                print(f"Current rate for {host}: {throttle.rates().get(host, 0):.3f} requests/s")
+            for lang in args.langs:
+                if host_of(languages[lang][0]) == host:
+                    retry_failures(lang, args.out_dir, ledger, failures, counts)
+
+        run_by_host(dfs_by_host, crawl_host)
+        dead_letters, dead_letter_source = failures.dead(), failures.dead_letter_path
 
+    metrics.stop_exporter(*METRICS_PATHS)
+    print(metrics.summary())
     pprint.pprint(counts)
-    print(f"Num unprocessed: {df_all['is_processed'].value_counts()[0]}")
-    print(f"Num processed:   {df_all['is_processed'].value_counts()[1]}")
+    print(f"Num unprocessed: {ledger.num_unprocessed()}")
+    print(f"Num processed:   {ledger.num_processed()}")
+    print(f"Num dead-letter: {len(dead_letters)} (see {dead_letter_source})")
+    ledger.close()
     print(f"Total runtime:   {str(datetime.timedelta(seconds=round(time.time() - start_time)))}")
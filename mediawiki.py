@@ -0,0 +1,114 @@
+"""
+Batched lookups against the MediaWiki API (`api.php`) of the WikiHow sites.
+
+`prop=info` accepts up to 50 pipe-separated titles per query, so article URLs
+are grouped by host and resolved 50 at a time into their `pageid`, `lastrevid`
+and `touched` timestamp. Results are kept in a persistent local cache
+(`page_ids.jsonl`), which gives a stable key to deduplicate articles that show
+up under several categories or URLs.
+"""
+
+import os
+import json
+import threading
+from urllib.parse import urlsplit, unquote, urlencode
+from typing import Dict, Iterable, List, Optional
+
+import http_cache
+from politeness import host_of, run_by_host
+
+API_BATCH_SIZE = 50
+
+
+def title_of(url_addr: str) -> str:
+    """ Returns the page title encoded in an article URL. """
+    return unquote(urlsplit(url_addr).path.lstrip("/"))
+
+
+class PageInfoCache:
+    """ Persistent url -> {pageid, lastrevid, touched} cache, stored as an append-only JSONL file. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pages = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:  # torn last line after a crash
+                        continue
+                    self.pages[row["url"]] = row["info"]
+
+    def __contains__(self, url_addr: str) -> bool:
+        return url_addr in self.pages
+
+    def get(self, url_addr: str) -> Optional[dict]:
+        return self.pages.get(url_addr)
+
+    def update(self, infos: Dict[str, Optional[dict]]) -> None:
+        """ Stores a batch of results (None for pages that do not exist). """
+        with self._lock:
+            self.pages.update(infos)
+            with open(self.path, "a", encoding="utf-8") as f:
+                for url_addr, info in infos.items():
+                    f.write(json.dumps({"url": url_addr, "info": info}, ensure_ascii=False) + "\n")
+
+
+def query_page_info(host_url: str, urls: List[str]) -> Dict[str, Optional[dict]]:
+    """ Resolves up to 50 article URLs of a single site with one `prop=info` query. """
+    titles = {title_of(url_addr): url_addr for url_addr in urls}
+    params = {
+        "format": "json",
+        "action": "query",
+        "prop": "info",
+        "redirects": 1,
+        "titles": "|".join(titles),
+    }
+    r = http_cache.get(f"{host_url}/api.php?{urlencode(params)}", use_cache=False, stage="api_fetch")
+    query = r.json()["query"]
+
+    # Follow the title normalizations and redirects applied by the API back to our URLs
+    aliases = {title: title for title in titles}
+    for key in ("normalized", "redirects"):
+        for entry in query.get(key, []):
+            for title, alias in aliases.items():
+                if alias == entry["from"]:
+                    aliases[title] = entry["to"]
+
+    by_title = {}
+    for page in query.get("pages", {}).values():
+        if "pageid" in page:
+            by_title[page["title"]] = {
+                "pageid": page["pageid"],
+                "lastrevid": page.get("lastrevid"),
+                "touched": page.get("touched"),
+            }
+    return {url_addr: by_title.get(aliases[title]) for title, url_addr in titles.items()}
+
+
+def resolve_pages(urls: Iterable[str], cache: Optional[PageInfoCache] = None, refresh: bool = False) -> Dict[str, Optional[dict]]:
+    """
+    Returns {url: {"pageid", "lastrevid", "touched"}} for a stream of article URLs (None if the page does not exist).
+
+    URLs are grouped by host and resolved in batches of 50, different hosts in parallel.
+    Cached URLs are not queried again unless `refresh` is set (e.g. to get the current revisions).
+    """
+    results, to_query = {}, {}
+    for url_addr in urls:
+        if not refresh and cache is not None and url_addr in cache:
+            results[url_addr] = cache.get(url_addr)
+        else:
+            to_query.setdefault(host_of(url_addr), []).append(url_addr)
+
+    def resolve_host(host: str, host_urls: List[str]) -> None:
+        scheme = urlsplit(host_urls[0]).scheme
+        for start in range(0, len(host_urls), API_BATCH_SIZE):
+            infos = query_page_info(f"{scheme}://{host}", host_urls[start:start+API_BATCH_SIZE])
+            if cache is not None:
+                cache.update(infos)
+            results.update(infos)
+
+    run_by_host(to_query, resolve_host)
+    return results
@@ -1,52 +1,230 @@
+"""
+Usage example:
+     python merge_categories.py --data_dir ./output_final --lang es --seed 42
+
+Merges the per-category files `wikihow_<lang>_<category>.jsonl` written by `main.py` into a
+shuffled corpus split in `--num_shards` files `wikihow_<lang>-0000K-of-0000N.jsonl`, plus a
+sidecar `wikihow_<lang>.index.json` with the byte offsets of the records of every category
+(see `corpus.py`). Records are streamed: the category files are read lazily, shuffled with a
+seeded external (bucketed) shuffle on disk and written incrementally, so peak memory depends
+on `--chunk_size`, not on the size of the corpus.
+
+Before merging, a first streaming pass clusters near-duplicate articles (the same how-to under
+another URL, a redirect or another category) with MinHash/LSH (see `minhash.py`). Only the
+record with the most text of every cluster is kept, listing in `other_categories` the other
+categories where its duplicates were found. `--no_dedup` skips this pass.
+
+With `--columnar parquet` (default) or `--columnar arrow`, the corpus is also exported as a
+columnar dataset with the features of `WikiHowEs`, hive-partitioned by language and category
+under `<data_dir>/wikihow_<format>/lang=<lang>/category=<category>/`. Parquet files are zstd
+compressed; Arrow IPC files are left uncompressed so they can be memory-mapped without copies
+(see `load_columnar` in `corpus.py`).
+"""
+
 import os
-import re
 import json
-import pandas as pd
+import random
+import argparse
+import tempfile
 from glob import glob
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from corpus import ShardedWriter, columnar_path, iter_records as iter_merged
+from formatting import add_answers, to_example
+from minhash import LSHIndex, MinHasher, shingles
+
+COLUMNS = ["language", "category", "url", "title", "intro", "methods", "answers", "short_answers", "num_methods", "is_steps", "expert_author", "num_refs", "other_categories"]
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--data_dir', default='./output_final', type=str)
+    parser.add_argument('-l', '--lang', default='es', type=str)
+    parser.add_argument('-s', '--seed', default=42, type=int)
+    parser.add_argument('-c', '--chunk_size', default=10000, type=int, help='Approximate number of records held in memory at once')
+    parser.add_argument('-n', '--num_shards', default=8, type=int)
+    parser.add_argument('--no_dedup', action='store_true', help='Keep near-duplicate articles')
+    parser.add_argument('--dup_threshold', default=0.8, type=float, help='Estimated Jaccard similarity of near-duplicates')
+    parser.add_argument('--columnar', default='parquet', choices=['parquet', 'arrow', 'none'], help='Columnar export of the merged corpus')
+    return parser.parse_args()
+
+def category_files(data_dir: str, lang: str) -> List[Tuple[str, str, str]]:
+    """ Returns (path, language, category) for every per-category file of a language, in a stable order. """
+    files = []
+    for data_file in sorted(glob(os.path.join(data_dir, f"wikihow_{lang}_*.jsonl"))):
+        name = os.path.basename(data_file)[:-len(".jsonl")]
+        language, category = name.split("_")[-2], name.split("_")[-1]
+        files.append((data_file, language, category))
+    return files
+
+def count_records(files: List[Tuple[str, str, str]]) -> int:
+    """ Counts the records of the given files without decoding them. """
+    total = 0
+    for data_file, _, _ in files:
+        with open(data_file, "rb") as f:
+            total += sum(1 for line in f if line.strip())
+    return total
+
+def iter_crawled(files: List[Tuple[str, str, str]]) -> Iterator[dict]:
+    """ Lazily reads the category files, yielding the crawled records with their language and category. """
+    for data_file, language, category in files:
+        with open(data_file, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                data["language"] = language
+                data["category"] = category
+                yield data
+
+def iter_records(files: List[Tuple[str, str, str]]) -> Iterator[dict]:
+    """ Lazily reads the category files, yielding records with the merged columns and formatted answers. """
+    for data in iter_crawled(files):
+        data["num_refs"] = int(data.get("num_refs") or 0)
+        add_answers(data)
+        yield {column: data.get(column) for column in COLUMNS}
+
+def find_duplicates(records: Iterable[dict], threshold: float) -> Tuple[List[bool], Dict[int, List[str]]]:
+    """
+    Clusters near-duplicate records, given in stream order.
+
+    Returns whether every record is the one kept for its cluster (the one with most shingles,
+    the first one on ties), and the other categories of the clusters of the kept records.
+    """
+    hasher, lsh = MinHasher(), LSHIndex(threshold=threshold)
+    sizes, categories = [], []
+    for record in records:
+        shingle_set = shingles(record)
+        lsh.add(hasher.signature(shingle_set), indexed=bool(shingle_set))
+        sizes.append(len(shingle_set))
+        categories.append(record["category"])
+
+    members = {}
+    for item, cluster in enumerate(lsh.clusters()):
+        members.setdefault(cluster, []).append(item)
+    keep, other_categories = [True] * len(sizes), {}
+    for items in members.values():
+        if len(items) == 1:
+            continue
+        canonical = max(items, key=lambda item: (sizes[item], -item))
+        for item in items:
+            keep[item] = item == canonical
+        other_categories[canonical] = sorted({categories[item] for item in items} - {categories[canonical]})
+    return keep, other_categories
+
+def external_shuffle(lines: Iterator[str], num_lines: int, seed: int, chunk_size: int, tmp_dir: str) -> Iterator[str]:
+    """
+    Shuffles a stream of lines with bounded memory.
+
+    Every line is sent to one of ceil(N/chunk_size) bucket files chosen at random; each bucket
+    is then shuffled in memory and emitted in turn. The result is a uniform permutation that
+    only depends on the input order and the seed.
+    """
+    rng = random.Random(seed)
+    num_buckets = max(1, -(-num_lines // chunk_size))
+    paths = [os.path.join(tmp_dir, f"bucket_{i:05d}.jsonl") for i in range(num_buckets)]
+    buckets = [open(path, "w", encoding="utf-8") for path in paths]
+    try:
+        for line in lines:
+            buckets[rng.randrange(num_buckets)].write(line + "\n")
+    finally:
+        for bucket in buckets:
+            bucket.close()
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            chunk = f.read().split("\n")[:-1]  # not splitlines(): records may contain U+2028
+        os.remove(path)
+        rng.shuffle(chunk)
+        yield from chunk
+
+def merge(data_dir: str, lang: str, seed: int, chunk_size: int, num_shards: int, dedup: bool = True,
+          dup_threshold: float = 0.8) -> str:
+    """ Streams all the category files of a language into shuffled shards; returns the path of their index. """
+    files = category_files(data_dir, lang)
+    if dedup:
+        keep, other_categories = find_duplicates(iter_crawled(files), dup_threshold)  # no need to format answers here
+        num_records = sum(keep)
+        print(f"Dropped {len(keep) - num_records} near-duplicates from {len(other_categories)} clusters")
+    else:
+        num_records = count_records(files)
+        keep, other_categories = None, {}
+    print(f"Merging {num_records} records from {len(files)} category files...")
+
+    def deduplicated():
+        for i, record in enumerate(iter_records(files)):
+            if keep is None or keep[i]:
+                record["other_categories"] = other_categories.get(i, [])
+                yield record
+
+    # The category travels in front of every line (JSON strings never contain a raw tab)
+    lines = (f"{record['category']}\t{json.dumps(record, ensure_ascii=False)}" for record in deduplicated())
+    writer = ShardedWriter(data_dir, f"wikihow_{lang}", num_records, num_shards)
+    with tempfile.TemporaryDirectory(dir=data_dir) as tmp_dir:
+        for line in external_shuffle(lines, num_records, seed, chunk_size, tmp_dir):
+            category, record = line.split("\t", 1)
+            writer.write(category, record)
+    return writer.close()
+
+def columnar_schema():
+    """ Arrow schema matching the features of `WikiHowEs`, plus the `lang` partition column. """
+    import pyarrow as pa
+
+    return pa.schema([
+        ("lang", pa.string()),
+        ("category", pa.string()),
+        ("question", pa.string()),
+        ("introduction", pa.string()),
+        ("other_categories", pa.list_(pa.string())),
+        ("answers", pa.list_(pa.string())),
+        ("short_answers", pa.list_(pa.string())),
+        ("url", pa.string()),
+        ("num_answers", pa.int32()),
+        ("num_refs", pa.int32()),
+        ("expert_author", pa.bool_()),
+    ])
+
+def iter_batches(index_file: str, lang: str, batch_size: int):
+    """ Streams the merged corpus as Arrow record batches of dataset examples. """
+    import pyarrow as pa
+
+    schema, rows = columnar_schema(), []
+    for record in iter_merged(index_file):
+        rows.append(dict(to_example(record), lang=lang))
+        if len(rows) == batch_size:
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+            rows = []
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+def export_columnar(index_file: str, data_dir: str, lang: str, file_format: str, batch_size: int) -> str:
+    """ Writes the merged corpus as a Parquet/Arrow dataset partitioned by language and category. """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    out_dir = columnar_path(data_dir, file_format)
+    if file_format == "parquet":
+        fmt = ds.ParquetFileFormat()
+        file_options = fmt.make_write_options(compression="zstd")
+    else:
+        fmt = ds.IpcFileFormat()
+        file_options = fmt.make_write_options(compression=None)
+    ds.write_dataset(
+        iter_batches(index_file, lang, batch_size),
+        out_dir,
+        schema=columnar_schema(),
+        format=fmt,
+        file_options=file_options,
+        partitioning=ds.partitioning(pa.schema([("lang", pa.string()), ("category", pa.string())]), flavor="hive"),
+        existing_data_behavior="delete_matching",  # only replaces the partitions of this language
+        max_rows_per_group=batch_size,
+    )
+    return out_dir
 
-DATA_DIR = "./output_final"
-
-def format_methods(methods):
-    formatted = []
-    for method in methods:
-        if method["title"].lower() != "pasos":
-            content = f"Método {method['number']}: {method['title']}\n\n"
-            for step in method["steps"]:
-                step_content = re.sub(r"\n+", "\n", step).strip()
-                content += step_content + "\n\n"
-        else:
-            content = "Sigue los siguientes pasos:\n\n"
-            for step in method["steps"]:
-                step_content = re.sub(r"\n+", "\n", step).strip()
-                content += step_content + "\n\n"
-        formatted.append(content.strip())
-    return formatted
-
-data_files = glob(os.path.join(DATA_DIR, "wikihow_es_*.jsonl"))
-
-dfs = []
-for data_file in data_files:
-    category = data_file.split(".")[-2].split("_")[-1]
-    language = data_file.split(".")[-2].split("_")[-2]
-    curr_df = pd.read_json(data_file, lines=True)
-    curr_df["language"] = language
-    curr_df["category"] = category
-    dfs.append(curr_df)
-
-df = pd.concat(dfs, ignore_index=False)
-df = df[["language", "category", "url", "title", "intro", "methods", "num_methods", "is_steps", "expert_author", "num_refs"]]
-
-aux_bool = True
-while aux_bool:
-    df = df.sample(frac=1)
-    import pdb; pdb.set_trace()
-
-# df["content"] = df["methods"].apply(lambda x: format_methods(x)) # better to do this directly in the dataloader
-df["num_refs"] = df["num_refs"].fillna(0)
-df["num_refs"] = df["num_refs"].astype(int)
-
-out_filename = os.path.join(DATA_DIR, "wikihow_es.jsonl")
-
-list_dicts = df.to_dict("records")
-with open(out_filename, "w") as f:
-    f.write('\n'.join(json.dumps(i, ensure_ascii=False) for i in list_dicts))
\ No newline at end of file
+if __name__ == "__main__":
+    args = parse_args()
+    print(args)
+    index_file = merge(args.data_dir, args.lang, args.seed, args.chunk_size, args.num_shards,
+                       not args.no_dedup, args.dup_threshold)
+    print(f"Done! Index stored in {index_file}")
+    if args.columnar != "none":
+        print(f"Columnar export stored in {export_columnar(index_file, args.data_dir, args.lang, args.columnar, args.chunk_size)}")
@@ -0,0 +1,152 @@
+"""
+Crawl instrumentation: per-stage timers and labelled counters.
+
+Stages are timed with `metrics.timer("article_parse", lang="es")` and events are
+counted with `metrics.inc("http_bytes_total", len(body), host=host)`. A background
+exporter periodically appends a JSON snapshot (totals plus per-second rates since
+the previous snapshot) to `metrics.jsonl` and rewrites `metrics.prom` in the
+Prometheus text format, so the bottleneck of a long crawl can be spotted without
+attaching a profiler.
+"""
+
+import os
+import json
+import time
+import threading
+import collections
+from contextlib import contextmanager
+from typing import Optional
+
+PROMETHEUS_PREFIX = "wikihow_"
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in labels)
+    return "{" + pairs + "}"
+
+
+class Metrics:
+    """ Thread-safe counters and stage timers with periodic JSON-lines / Prometheus export. """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self._counters = collections.Counter()  # (name, labels) -> value
+        self._timings = {}  # (stage, labels) -> [count, total seconds, max seconds]
+        self._lock = threading.Lock()
+        self._previous = (self.start_time, collections.Counter())
+        self._stop = threading.Event()
+        self._exporter = None
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        with self._lock:
+            self._counters[_key(name, labels)] += value
+
+    def observe(self, stage: str, seconds: float, **labels) -> None:
+        with self._lock:
+            timing = self._timings.setdefault(_key(stage, labels), [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    @contextmanager
+    def timer(self, stage: str, **labels):
+        """ Times the enclosed block as one execution of `stage`. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        """ Returns the current totals, the stage timings and the counter rates since the last snapshot. """
+        now = time.time()
+        with self._lock:
+            counters = collections.Counter(self._counters)
+            timings = {key: list(value) for key, value in self._timings.items()}
+            previous_time, previous_counters = self._previous
+            self._previous = (now, counters)
+        elapsed = max(now - previous_time, 1e-9)
+        return {
+            "time": now,
+            "uptime": now - self.start_time,
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value,
+                 "per_second": (value - previous_counters.get((name, labels), 0)) / elapsed}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "stages": [
+                {"stage": stage, "labels": dict(labels), "count": count, "total_seconds": total,
+                 "mean_seconds": total / count if count else 0.0, "max_seconds": longest}
+                for (stage, labels), (count, total, longest) in sorted(timings.items())
+            ],
+        }
+
+    def to_prometheus(self) -> str:
+        """ Renders the counters and stage timings in the Prometheus text exposition format. """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            timings = sorted(self._timings.items())
+        lines, declared = [], set()
+        for (name, labels), value in counters:
+            metric = PROMETHEUS_PREFIX + name
+            if metric not in declared:
+                lines.append(f"# TYPE {metric} counter")
+                declared.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+        if timings:
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}stage_seconds summary")
+            for (stage, labels), (count, total, _) in timings:
+                stage_labels = _format_labels((("stage", stage),) + labels)
+                lines.append(f"{PROMETHEUS_PREFIX}stage_seconds_count{stage_labels} {count}")
+                lines.append(f"{PROMETHEUS_PREFIX}stage_seconds_sum{stage_labels} {total}")
+            lines.append(f"# TYPE {PROMETHEUS_PREFIX}stage_max_seconds gauge")
+            for (stage, labels), (_, _, longest) in timings:
+                lines.append(f"{PROMETHEUS_PREFIX}stage_max_seconds{_format_labels((('stage', stage),) + labels)} {longest}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, jsonl_path: Optional[str] = None, prom_path: Optional[str] = None) -> None:
+        """ Appends one JSON snapshot and/or rewrites the Prometheus file. """
+        if jsonl_path:
+            with open(jsonl_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.snapshot(), ensure_ascii=False) + "\n")
+        if prom_path:
+            with open(prom_path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(self.to_prometheus())
+            os.replace(prom_path + ".tmp", prom_path)
+
+    def start_exporter(self, jsonl_path: Optional[str], prom_path: Optional[str], interval: float = 60.0) -> None:
+        """ Exports the metrics every `interval` seconds from a background thread. """
+        def run():
+            while not self._stop.wait(interval):
+                self.export(jsonl_path, prom_path)
+        self._stop.clear()
+        self._exporter = threading.Thread(target=run, daemon=True)
+        self._exporter.start()
+
+    def stop_exporter(self, jsonl_path: Optional[str] = None, prom_path: Optional[str] = None) -> None:
+        """ Stops the background exporter and writes a final export. """
+        self._stop.set()
+        if self._exporter is not None:
+            self._exporter.join()
+            self._exporter = None
+        self.export(jsonl_path, prom_path)
+
+    def summary(self) -> str:
+        """ Returns a human-readable table of the stage timings. """
+        with self._lock:
+            timings = sorted(self._timings.items())
+        rows = []
+        for (stage, labels), (count, total, longest) in timings:
+            labels = ",".join(f"{k}={v}" for k, v in labels)
+            rows.append(f"{stage:<16} {labels:<28} n={count:<7} total={total:9.2f}s "
+                        f"mean={total/count*1000:8.1f}ms max={longest:7.2f}s")
+        return "\n".join(rows)
+
+
+metrics = Metrics()
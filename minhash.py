@@ -0,0 +1,116 @@
+"""
+Near-duplicate detection with MinHash signatures and LSH banding.
+
+An article is represented by the set of word 3-grams (shingles) of its title, introduction
+and steps, tokenized like the search index (see `lexical_index.tokenize`). Its MinHash
+signature is the minimum of `num_perm` universal hashes (a * x + b) mod (2^31 - 1) over the
+CRC32 of its shingles; two signatures agree on a position with probability equal to the
+Jaccard similarity of the shingle sets.
+
+`LSHIndex` splits signatures in `num_bands` bands: articles sharing a band are candidates,
+and candidates whose signatures agree on at least `threshold` of the positions are merged
+with a union-find. Only one member of a cluster is kept per bucket, so the work stays close
+to linear in the number of articles instead of comparing all pairs.
+"""
+
+import zlib
+from typing import Iterable, List
+
+import numpy as np
+
+from lexical_index import tokenize
+
+NUM_PERM = 64
+NUM_BANDS = 16
+SHINGLE_SIZE = 3
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def shingles(record: dict, size: int = SHINGLE_SIZE) -> set:
+    """ Word n-grams of the title, introduction and steps of a record. """
+    texts = [record.get("title") or "", record.get("intro") or ""]
+    texts += [step for method in record.get("methods") or [] for step in method["steps"]]
+    tokens = tokenize("\n".join(texts))
+    if len(tokens) < size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHasher:
+    """ MinHash signatures with `num_perm` seeded universal hash functions. """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.a = rng.randint(1, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.int64)
+        self.b = rng.randint(0, MERSENNE_PRIME, size=(num_perm, 1), dtype=np.int64)
+
+    def signature(self, shingle_set: Iterable[str]) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set), dtype=np.int64)
+        if not len(hashes):
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.uint32)
+        # a < 2^31 and crc32 < 2^32, so a * x fits in an int64
+        return ((self.a * hashes + self.b) % MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+
+class LSHIndex:
+    """ Clusters signatures added one by one; items are numbered in order of addition. """
+
+    def __init__(self, num_perm: int = NUM_PERM, num_bands: int = NUM_BANDS, threshold: float = 0.8, capacity: int = 1024):
+        assert num_perm % num_bands == 0, "num_perm must be a multiple of num_bands"
+        self.rows = num_perm // num_bands
+        self.threshold = threshold
+        self.buckets = [{} for _ in range(num_bands)]
+        # One contiguous array each rather than an object per item, grown by doubling
+        self.signatures = np.empty((capacity, num_perm), dtype=np.uint32)
+        self.parent = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def _grow(self) -> None:
+        capacity = 2 * len(self.parent)
+        signatures = np.empty((capacity, self.signatures.shape[1]), dtype=np.uint32)
+        signatures[:self.size] = self.signatures[:self.size]
+        parent = np.empty(capacity, dtype=np.int64)
+        parent[:self.size] = self.parent[:self.size]
+        self.signatures, self.parent = signatures, parent
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = int(self.parent[i])
+        return i
+
+    def _union(self, i: int, j: int) -> None:
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+    def add(self, signature: np.ndarray, indexed: bool = True) -> int:
+        """ Adds a signature, merging it with the similar ones already added; returns its id. """
+        if self.size == len(self.parent):
+            self._grow()
+        item = self.size
+        self.signatures[item] = signature
+        self.parent[item] = item
+        self.size += 1
+        if not indexed:  # e.g. empty articles, which would all look alike
+            return item
+        for band, bucket in enumerate(self.buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            members = bucket.setdefault(key, [])
+            matched = False
+            for other in members:
+                if self.find(other) == self.find(item):
+                    matched = True
+                    break
+                if np.mean(self.signatures[other] == signature) >= self.threshold:
+                    self._union(other, item)
+                    matched = True
+                    break
+            if not matched:
+                members.append(item)
+        return item
+
+    def clusters(self) -> List[int]:
+        """ Returns the cluster of every item, identified by its smallest member. """
+        return [self.find(i) for i in range(self.size)]
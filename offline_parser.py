@@ -0,0 +1,103 @@
+"""
+Usage example:
+     bash download_categories.sh
+     python offline_parser.py --mirror_dir . --lang es --out_dir output_offline
+
+Extracts the articles of a local HTML mirror of WikiHow, such as the one produced by
+`download_categories.sh` (`wget -r`), without touching the network. The category pages
+of the mirror tell which articles belong to which category, and every article is parsed
+into the same dictionary as `main.process_article`, using all the cores of the machine.
+The results are written to the usual `wikihow_<lang>_<category>.jsonl` files.
+"""
+
+import os
+import json
+import time
+import datetime
+import argparse
+import collections
+from urllib.parse import urlsplit, unquote
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from main import languages, parse_urls, parse_article, transform_article
+from politeness import host_of
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--mirror_dir', default='.', type=str, help='Directory containing the host folder created by wget')
+    parser.add_argument('-l', '--lang', default='es', choices=list(languages.keys()))
+    parser.add_argument('-o', '--out_dir', default='./output_offline', type=str)
+    parser.add_argument('-w', '--num_workers', default=os.cpu_count(), type=int)
+    return parser.parse_args()
+
+def local_path(site_dir: str, url_addr: str) -> str:
+    """ Returns the path where wget stores the page of a given URL. """
+    path = unquote(urlsplit(url_addr).path).lstrip("/")
+    return os.path.join(site_dir, path)
+
+def find_articles(site_dir: str, category_trans: str) -> Dict[str, Tuple[str, str]]:
+    """ Returns {url: (category, local path)} for every article listed in the category pages of the mirror. """
+    articles = {}
+    prefix = f"{category_trans}:"
+    for filename in sorted(os.listdir(site_dir)):
+        if not filename.startswith(prefix):
+            continue
+        category = filename[len(prefix):].split("?")[0].split(".")[0]
+        with open(os.path.join(site_dir, filename), "rb") as f:
+            urls = parse_urls(f.read())
+        for url_addr in urls:
+            path = local_path(site_dir, url_addr)
+            if url_addr not in articles and os.path.isfile(path):
+                articles[url_addr] = (category, path)
+    return articles
+
+def extract_article(job: Tuple[str, str, str]) -> Tuple[str, str, Optional[str]]:
+    """ Parses one mirrored article; returns (category, url, JSON line or None on failure). """
+    url_addr, category, path = job
+    try:
+        with open(path, "rb") as f:
+            html = f.read()
+        processed_article = transform_article(parse_article(url_addr, html))
+        return category, url_addr, json.dumps(processed_article, ensure_ascii=False)
+    except Exception:
+        return category, url_addr, None
+
+if __name__ == "__main__":
+    start_time = time.time()
+
+    args = parse_args()
+    print(args)
+
+    if not os.path.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+
+    home_page, _, category_trans = languages[args.lang]
+    site_dir = os.path.join(args.mirror_dir, host_of(home_page))
+    articles = find_articles(site_dir, category_trans)
+    print(f"Found {len(articles)} articles in {site_dir}")
+
+    jobs = [(url_addr, category, path) for url_addr, (category, path) in articles.items()]
+    out_files = {}
+    counts, failures = collections.Counter(), []
+    with ProcessPoolExecutor(max_workers=args.num_workers) as pool:
+        for category, url_addr, line in pool.map(extract_article, jobs, chunksize=32):
+            if line is None:
+                failures.append(url_addr)
+                continue
+            if category not in out_files:
+                out_files[category] = open(f"{args.out_dir}/wikihow_{args.lang}_{category.lower()}.jsonl", 'w')
+            out_files[category].write(line + "\n")
+            counts[category] += 1
+    for out_file in out_files.values():
+        out_file.close()
+
+    with open(os.path.join(args.out_dir, f"unprocessed_{args.lang}.txt"), "w") as f:
+        f.write("\n".join(failures))
+
+    print(dict(counts))
+    print(f"Num failures:  {len(failures)}")
+    print(f"Num successes: {sum(counts.values())}")
+    print(f"Total runtime: {str(datetime.timedelta(seconds=round(time.time() - start_time)))}")
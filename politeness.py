@@ -0,0 +1,119 @@
+"""
+Per-host politeness scheduling for the crawler.
+
+Every WikiHow language site is a separate host, so each host gets its own rate
+limit and its own worker thread: requests to one host stay `--delay` seconds
+apart, while different hosts are crawled fully in parallel.
+
+`AdaptiveThrottle` adjusts that interval from the responses of every host
+(AIMD): it speeds up slowly after a stream of successes, halves the rate on
+429/503 and other server errors, and honors `Retry-After`.
+"""
+
+import time
+import collections
+import datetime
+import threading
+import email.utils
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+def host_of(url_addr: str) -> str:
+    """ Returns the host name of a URL (e.g. `es.wikihow.com`). """
+    return urlsplit(url_addr).netloc
+
+
+class HostThrottle:
+    """ Enforces a minimum interval between two consecutive requests to the same host. """
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next_slot = {}  # host -> earliest time of the next request
+        self._lock = threading.Lock()
+
+    def interval(self, host: str) -> float:
+        return self.min_interval
+
+    def wait(self, host: str) -> None:
+        """ Blocks until a request to `host` is allowed; other hosts are not affected. """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval(host)
+        if slot > now:
+            time.sleep(slot - now)
+
+    def feedback(self, host: str, status_code: int, retry_after: Optional[str] = None) -> None:
+        """ Fixed-rate throttles ignore server feedback. """
+
+    def rates(self) -> Dict[str, float]:
+        """ Returns the current rate (requests/second) of every host seen so far. """
+        with self._lock:
+            intervals = {host: self.interval(host) for host in self._next_slot}
+        return {host: 1.0 / interval if interval > 0 else float("inf") for host, interval in intervals.items()}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """ Returns the number of seconds requested by a `Retry-After` header (in seconds or as an HTTP date). """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+class AdaptiveThrottle(HostThrottle):
+    """ Per-host rate controller driven by server feedback (additive increase, multiplicative decrease). """
+
+    BACKOFF_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, initial_interval: float, min_interval: float, max_interval: float = 300.0,
+                 increase_every: int = 10, increase_step: float = 0.02, backoff_factor: float = 2.0):
+        super().__init__(initial_interval)
+        self.initial_interval = initial_interval
+        self.min_interval = min(min_interval, initial_interval)
+        self.max_interval = max_interval
+        self.increase_every = increase_every
+        self.increase_step = increase_step  # requests/second added after every streak of successes
+        self.backoff_factor = backoff_factor
+        self._interval = {}  # host -> current interval
+        self._streak = collections.Counter()
+
+    def interval(self, host: str) -> float:
+        return self._interval.get(host, self.initial_interval)
+
+    def feedback(self, host: str, status_code: int, retry_after: Optional[str] = None) -> None:
+        """ Updates the rate of a host from the status (and `Retry-After`) of one of its responses. """
+        with self._lock:
+            interval = self.interval(host)
+            if status_code in self.BACKOFF_STATUSES:
+                self._streak[host] = 0
+                interval = min(self.max_interval, interval * self.backoff_factor)
+                pause = parse_retry_after(retry_after)
+                if pause is not None:
+                    interval = min(self.max_interval, max(interval, pause))
+                    self._next_slot[host] = max(self._next_slot.get(host, 0.0), time.monotonic() + pause)
+            elif status_code < 400:
+                self._streak[host] += 1
+                if self._streak[host] >= self.increase_every and interval > self.min_interval:
+                    self._streak[host] = 0
+                    interval = max(self.min_interval, 1.0 / (1.0 / interval + self.increase_step))
+            self._interval[host] = interval
+
+
+def run_by_host(jobs_by_host: Dict[str, List], worker: Callable) -> None:
+    """ Runs `worker(host, jobs)` for every host in its own thread and waits for all of them. """
+    if not jobs_by_host:
+        return
+    with ThreadPoolExecutor(max_workers=len(jobs_by_host)) as pool:
+        futures = [pool.submit(worker, host, jobs) for host, jobs in jobs_by_host.items()]
+        for future in futures:
+            future.result()
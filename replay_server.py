@@ -0,0 +1,199 @@
+"""
+Usage example:
+     python main.py --langs es --out_dir ./output --record_dir ./recordings   # once, against the live site
+     python replay_server.py --recordings ./recordings ./output/http_cache --origin https://es.wikihow.com --port 8000
+     python main.py --langs es --out_dir /tmp/replayed --base_url es=http://127.0.0.1:8000 --delay 0 --min_delay 0
+
+Local stand-in for a WikiHow site: serves the responses recorded by `main.py --record_dir`
+(category listings, CategoryListing pages, articles and `api.php` queries) and the bodies of
+an `http_cache` directory, so that the crawler can be tuned without touching the live site.
+
+Requests are matched on their decoded path and query. Links to the recorded origin inside
+the bodies are rewritten to the address of the replay server, so the crawler follows them
+here. Every response can be delayed (`--latency_ms` +/- `--jitter_ms`) and replaced by a
+503 (`--error_rate`) or a 429 with a Retry-After header (`--throttle_rate`), drawn from a
+seeded generator. Bodies are served with their hash as ETag and honor If-None-Match.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import threading
+import collections
+from glob import glob
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+from typing import Dict, List, Optional
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--recordings', nargs='+', required=True, help='Record directories and/or http_cache directories')
+    parser.add_argument('-o', '--origin', default=None, type=str, help='Recorded site to serve, e.g. https://es.wikihow.com')
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('-p', '--port', default=8000, type=int)
+    parser.add_argument('--latency_ms', default=0.0, type=float, help='Mean delay of every response')
+    parser.add_argument('--jitter_ms', default=0.0, type=float, help='Uniform jitter around the mean delay')
+    parser.add_argument('--error_rate', default=0.0, type=float, help='Fraction of requests answered with a 503')
+    parser.add_argument('--throttle_rate', default=0.0, type=float, help='Fraction of requests answered with a 429')
+    parser.add_argument('--retry_after', default=1, type=int, help='Retry-After of the 429 responses, in seconds')
+    parser.add_argument('-s', '--seed', default=0, type=int)
+    return parser.parse_args()
+
+
+def origin_of(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def request_key(target: str) -> str:
+    """ Path and query of a URL or request target, percent-decoded so that both spellings match. """
+    parts = urlsplit(target)
+    return unquote(parts.path) + ("?" + unquote(parts.query) if parts.query else "")
+
+
+def load_recordings(paths: List[str]) -> Dict[str, Dict[str, dict]]:
+    """ Returns {origin: {request key: {status, content_type, body_path, etag}}}; later recordings win, except over successes. """
+    sites = collections.defaultdict(dict)
+    for path in paths:
+        responses_path = os.path.join(path, "responses.jsonl")
+        if os.path.isfile(responses_path):  # record directory of `main.py --record_dir`
+            with open(responses_path, encoding="utf-8") as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        else:  # http_cache directory: only successful, cacheable responses
+            entries = []
+            for meta_path in glob(os.path.join(path, "meta", "*.json")):
+                with open(meta_path, encoding="utf-8") as f:
+                    meta = json.load(f)
+                entries.append({"url": meta["url"], "status": 200, "content_type": None, "body_hash": meta["body_hash"]})
+        for entry in entries:
+            site, key = sites[origin_of(entry["url"])], request_key(entry["url"])
+            if key in site and site[key]["status"] < 400 <= entry["status"]:
+                continue  # errors are injected on demand, a recorded success is worth more
+            site[key] = {
+                "status": entry["status"],
+                "content_type": entry.get("content_type"),
+                "body_path": os.path.join(path, "bodies", entry["body_hash"]),
+                "etag": f'"{entry["body_hash"]}"',
+            }
+    return sites
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """ Serves the recorded responses of one origin, with fault injection. """
+
+    daemon_threads = True
+
+    def __init__(self, address: tuple, responses: Dict[str, dict], origin: str, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = 0):
+        super().__init__(address, ReplayHandler)
+        self.responses = responses
+        self.origin = origin
+        self.base_url = f"http://{self.server_address[0]}:{self.server_address[1]}"
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        # Absolute links (also JSON-escaped ones) must lead back here
+        self.rewrites = [
+            (origin.encode("utf-8"), self.base_url.encode("utf-8")),
+            (origin.replace("/", "\\/").encode("utf-8"), self.base_url.replace("/", "\\/").encode("utf-8")),
+        ]
+        self.rng = random.Random(seed)
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def draw(self) -> tuple:
+        """ Returns the (delay, injected status or None) of the next request. """
+        with self._lock:
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            u = self.rng.random()
+        if u < self.throttle_rate:
+            return delay, 429
+        if u < self.throttle_rate + self.error_rate:
+            return delay, 503
+        return delay, None
+
+    def body(self, response: dict) -> bytes:
+        with open(response["body_path"], "rb") as f:
+            content = f.read()
+        for old, new in self.rewrites:
+            content = content.replace(old, new)
+        return content
+
+    def count(self, status: int) -> None:
+        with self._lock:
+            self.counts[status] += 1
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real site
+
+    def _send(self, status: int, body: bytes = b"", headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(status)
+
+    def do_GET(self) -> None:
+        delay, injected = self.server.draw()
+        if delay:
+            time.sleep(delay)
+        if injected == 429:
+            return self._send(429, b"Too Many Requests", {"Retry-After": str(self.server.retry_after)})
+        if injected == 503:
+            return self._send(503, b"Service Unavailable")
+        response = self.server.responses.get(request_key(self.path))
+        if response is None:
+            return self._send(404, b"Not recorded")
+        if response["status"] == 200 and self.headers.get("If-None-Match") == response["etag"]:
+            return self._send(304, headers={"ETag": response["etag"]})
+        headers = {"ETag": response["etag"]}
+        if response["content_type"]:
+            headers["Content-Type"] = response["content_type"]
+        self._send(response["status"], self.server.body(response), headers)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def make_server(recordings: List[str], origin: Optional[str] = None, host: str = "127.0.0.1", port: int = 0, **options) -> ReplayServer:
+    """ Builds a server for one recorded origin (the only one if `origin` is None); port 0 picks a free port. """
+    sites = load_recordings(recordings)
+    if origin is None:
+        if len(sites) != 1:
+            raise ValueError(f"Several origins recorded, choose one with --origin: {sorted(sites)}")
+        origin = next(iter(sites))
+    if origin.rstrip("/") not in sites:
+        raise ValueError(f"Nothing recorded for {origin} (recorded: {sorted(sites)})")
+    origin = origin.rstrip("/")
+    return ReplayServer((host, port), sites[origin], origin, **options)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(args)
+    server = make_server(
+        args.recordings, args.origin, args.host, args.port,
+        latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after, seed=args.seed,
+    )
+    print(f"Replaying {len(server.responses)} responses of {server.origin} on {server.base_url}", flush=True)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        print(f"Responses served: {dict(server.counts)}", flush=True)
@@ -0,0 +1,121 @@
+"""
+Durable queue of the articles that could not be processed.
+
+Every failure is appended to `failures.jsonl` with its error class, the number of
+attempts and the time at which it may be retried. Transient errors (429, 5xx,
+timeouts...) are retried with exponential backoff, within the same run if
+possible. Permanent errors, such as a parse error on a given revision or a 404,
+go to `dead_letter.jsonl` and are not attempted again until the page changes.
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import requests
+import wikihowunofficialapi
+from typing import Dict, List, Optional, Tuple
+
+from http_cache import HTTPStatusError
+
+TRANSIENT_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def is_transient(exc: Exception) -> bool:
+    """ Tells whether an error is worth retrying later on the same revision of a page. """
+    if isinstance(exc, HTTPStatusError):
+        return exc.status_code in TRANSIENT_STATUSES
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(exc, wikihowunofficialapi.ParseError):
+        return False
+    return True  # unknown errors get the benefit of the doubt, up to `max_attempts`
+
+
+class FailureQueue:
+    """ Failed articles with their attempt count and next eligible time, plus a dead-letter file. """
+
+    def __init__(self, out_dir: str, max_attempts: int = 5, base_delay: float = 30.0, max_delay: float = 3600.0):
+        self.path = os.path.join(out_dir, "failures.jsonl")
+        self.dead_letter_path = os.path.join(out_dir, "dead_letter.jsonl")
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.entries = {}  # id -> latest failure
+        self._lock = threading.Lock()
+        if os.path.isfile(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("resolved"):
+                        self.entries.pop(entry["id"], None)
+                    else:
+                        self.entries[entry["id"]] = entry
+
+    def _append(self, path: str, entry: dict) -> None:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def schedule(self, attempts: int, exc: Exception) -> Tuple[bool, Optional[float]]:
+        """ Returns whether an article that failed `attempts` times is dead, and otherwise when it may be retried. """
+        if not is_transient(exc) or attempts >= self.max_attempts:
+            return True, None
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return False, time.time() + backoff * random.uniform(0.8, 1.2)
+
+    def record_failure(self, row: dict, exc: Exception) -> dict:
+        """ Records a failed attempt and schedules a retry, or moves the article to the dead-letter file. """
+        with self._lock:
+            previous = self.entries.get(row["id"], {})
+            attempts = previous.get("attempts", 0) + 1
+            dead, next_eligible = self.schedule(attempts, exc)
+            entry = {
+                "id": row["id"],
+                "url": row["url"],
+                "lang": row["lang"],
+                "category": row["category"],
+                "revid": row.get("lastrevid"),
+                "error": exc.__class__.__name__,
+                "message": str(exc),
+                "attempts": attempts,
+                "dead": dead,
+                "next_eligible": next_eligible,
+            }
+            self.entries[row["id"]] = entry
+            self._append(self.path, entry)
+            if dead:
+                self._append(self.dead_letter_path, entry)
+            return entry
+
+    def record_success(self, _id: str) -> None:
+        with self._lock:
+            if self.entries.pop(_id, None) is not None:
+                self._append(self.path, {"id": _id, "resolved": True})
+
+    def revive(self, _id: str) -> None:
+        """ Forgets a dead article (e.g. because its page changed), so that it gets crawled again. """
+        self.record_success(_id)
+
+    def is_dead(self, row: dict) -> bool:
+        """ Tells whether an article is dead-lettered for the revision we know of. """
+        entry = self.entries.get(row["id"])
+        return entry is not None and entry["dead"] and entry["revid"] == row.get("lastrevid")
+
+    def is_deferred(self, row: dict) -> bool:
+        """ Tells whether an article is waiting for its backoff to expire. """
+        entry = self.entries.get(row["id"])
+        return entry is not None and not entry["dead"] and entry["next_eligible"] > time.time()
+
+    def pending(self, lang: Optional[str] = None) -> List[dict]:
+        """ Returns the failures still to be retried, soonest first. """
+        with self._lock:
+            entries = [e for e in self.entries.values() if not e["dead"] and lang in (None, e["lang"])]
+        return sorted(entries, key=lambda e: e["next_eligible"])
+
+    def dead(self) -> Dict[str, dict]:
+        with self._lock:
+            return {_id: e for _id, e in self.entries.items() if e["dead"]}
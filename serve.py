@@ -0,0 +1,307 @@
+"""
+Usage example:
+     python serve.py --index_dir ./index_es/lexical --port 8080
+     curl "http://localhost:8080/search?q=cómo+hacer+pan&category=comida-y-diversión&k=5"
+     curl "http://localhost:8080/stats"
+
+Query service over an index of `lexical_index.py` or `dense_index.py`, loaded once at startup.
+
+Connections either speak HTTP/1.1 (GET /search?q=...&category=...&k=..., POST /search with a
+JSON body, GET /stats) or JSON lines: a connection whose first line is a JSON object gets one
+JSON response line per request line, e.g. {"q": "...", "category": null, "k": 10}.
+
+Queries arriving within `--batch_window` milliseconds of each other are scored together with
+one `search_batch` call, off the event loop. Results are cached in a bounded LRU keyed by the
+normalized query, the category filter and k, and identical queries in flight share one
+scoring. Latency percentiles and throughput are served
+at /stats and printed every `--stats_interval` seconds.
+"""
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import collections
+from urllib.parse import parse_qs, urlsplit
+from typing import List, Optional
+
+import numpy as np
+
+from lexical_index import fold
+
+MAX_K = 1000
+
+
+def parse_args() -> argparse.Namespace:
+    """ Parses command-line arguments. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--index_dir', default='./index_es/lexical', type=str, help='Lexical or dense index directory')
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('-p', '--port', default=8080, type=int)
+    parser.add_argument('-w', '--batch_window', default=5.0, type=float, help='Milliseconds to wait for more queries to batch')
+    parser.add_argument('-b', '--max_batch', default=64, type=int)
+    parser.add_argument('-c', '--cache_size', default=10000, type=int, help='Cached results (0 disables the cache)')
+    parser.add_argument('--stats_interval', default=60.0, type=float)
+    return parser.parse_args()
+
+
+def load_index(index_dir: str):
+    """ Opens a dense index if the directory holds embeddings, a lexical one otherwise. """
+    if os.path.exists(os.path.join(index_dir, "embeddings.npy")):
+        from dense_index import DenseIndex
+        return DenseIndex(index_dir)
+    from lexical_index import LexicalIndex
+    return LexicalIndex(index_dir)
+
+
+def normalize(query: str) -> str:
+    return " ".join(fold(query).split())
+
+
+class ResultCache:
+    """ Bounded LRU of search results. """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[list]:
+        """ Returns the cached hits of a key; misses are counted by the caller, which knows if the query gets scored. """
+        hits = self.entries.get(key)
+        if hits is None:
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return hits
+
+    def put(self, key: tuple, hits: list) -> None:
+        if self.capacity <= 0:
+            return
+        self.entries[key] = hits
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+
+class LatencyStats:
+    """ Latencies of the most recent queries and completion times for the throughput. """
+
+    def __init__(self, window: int = 10000):
+        self.start_time = time.time()
+        self.latencies = collections.deque(maxlen=window)
+        self.completed = collections.deque(maxlen=window)
+        self.total = 0
+        self.batches = 0
+        self.batched_queries = 0
+        self.shared = 0  # queries answered by an identical one in flight
+        self.errors = 0
+
+    def record(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+        self.completed.append(time.time())
+        self.total += 1
+
+    def snapshot(self, cache: ResultCache) -> dict:
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        now = time.time()
+        recent = [t for t in self.completed if t > now - 10]
+        return {
+            "queries": self.total,
+            "qps": len(recent) / min(10.0, max(now - self.start_time, 1e-9)),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "max_ms": float(latencies.max()),
+            "mean_batch_size": self.batched_queries / self.batches if self.batches else 0.0,
+            "cache_hits": cache.hits,
+            "cache_misses": cache.misses,
+            "shared_queries": self.shared,
+            "errors": self.errors,
+            "cache_entries": len(cache.entries),
+        }
+
+
+class SearchService:
+    """ Micro-batches concurrent queries into `search_batch` calls, behind a result cache. """
+
+    def __init__(self, index, batch_window: float, max_batch: int, cache_size: int):
+        self.index = index
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cache = ResultCache(cache_size)
+        self.stats = LatencyStats()
+        self.queue = asyncio.Queue()
+        self.in_flight = {}  # key -> future of a query already queued
+        self._worker = None
+
+    def start(self) -> None:
+        self._worker = asyncio.ensure_future(self._batch_loop())
+
+    async def search(self, query: str, category: Optional[str] = None, k: int = 10) -> List[dict]:
+        start = time.perf_counter()
+        category = None if category in (None, "", "all") else category.lower()
+        key = (normalize(query), category, k)
+        hits = self.cache.get(key)
+        if hits is None and key in self.in_flight:
+            self.stats.shared += 1
+            hits = await asyncio.shield(self.in_flight[key])
+        elif hits is None:
+            self.cache.misses += 1
+            future = self.in_flight[key] = asyncio.get_running_loop().create_future()
+            await self.queue.put((key, future))
+            try:
+                hits = await asyncio.shield(future)
+            finally:
+                del self.in_flight[key]
+            self.cache.put(key, hits)
+        self.stats.record(time.perf_counter() - start)
+        return hits
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            queries = [query for (query, _, _), _ in batch]
+            categories = [category for (_, category, _), _ in batch]
+            k = max(k for (_, _, k), _ in batch)
+            try:
+                results = await loop.run_in_executor(None, self.index.search_batch, queries, k, categories)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.stats.batches += 1
+            self.stats.batched_queries += len(batch)
+            for ((_, _, query_k), future), hits in zip(batch, results):
+                future.set_result(hits[:query_k])
+
+    async def _answer(self, request: dict) -> tuple:
+        """ Returns the (HTTP status, response) of a request. """
+        if not isinstance(request, dict):
+            return 400, {"error": "request must be a JSON object"}
+        query = request.get("q") or request.get("query")
+        if not query:
+            return 400, {"error": "missing query"}
+        if not isinstance(query, str):
+            return 400, {"error": "query must be a string"}
+        category = request.get("category")
+        if category is not None and not isinstance(category, str):
+            return 400, {"error": "category must be a string or null"}
+        try:
+            k = int(request.get("k", 10))
+        except (TypeError, ValueError):
+            return 400, {"error": "k must be an integer"}
+        if not 1 <= k <= MAX_K:
+            return 400, {"error": f"k must be between 1 and {MAX_K}"}
+        try:
+            hits = await self.search(query, category, k)
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"Search failed for {query!r}: {e.__class__.__name__}: {e}")
+            return 500, {"error": f"search failed ({e.__class__.__name__})"}
+        return 200, {"query": query, "hits": hits}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            first_line = await reader.readline()
+            if first_line.lstrip().startswith(b"{"):
+                await self._handle_jsonl(first_line, reader, writer)
+            else:
+                await self._handle_http(first_line, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:  # malformed request: drop the connection, not the server
+            print(f"Closing a connection after {e.__class__.__name__}: {e}")
+        finally:
+            writer.close()
+
+    async def _handle_jsonl(self, line: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while line:
+            if line.strip():
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    response = {"error": "invalid JSON"}
+                else:
+                    _, response = await self._answer(request)
+                writer.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+                await writer.drain()
+            line = await reader.readline()
+
+    async def _handle_http(self, line: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while line:
+            try:
+                method, target, _ = line.decode("latin-1").split(" ", 2)
+            except ValueError:
+                return
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = header.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            url = urlsplit(target)
+            status = 200
+            if url.path == "/stats":
+                response = self.stats.snapshot(self.cache)
+            elif url.path == "/search":
+                if method == "POST":
+                    try:
+                        request = json.loads(body or b"{}")
+                    except ValueError:
+                        request = {}
+                else:
+                    request = {key: values[0] for key, values in parse_qs(url.query).items()}
+                status, response = await self._answer(request)
+            else:
+                status, response = 404, {"error": "not found"}
+
+            payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+            reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}[status]
+            keep_alive = headers.get("connection", "").lower() != "close"
+            writer.write(
+                f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json; charset=utf-8\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                + payload
+            )
+            await writer.drain()
+            if not keep_alive:
+                return
+            line = await reader.readline()
+
+
+async def main(args: argparse.Namespace) -> None:
+    start = time.perf_counter()
+    index = load_index(args.index_dir)
+    print(f"Loaded {type(index).__name__} from {args.index_dir} in {time.perf_counter() - start:.2f}s")
+    service = SearchService(index, args.batch_window / 1000, args.max_batch, args.cache_size)
+    service.start()
+    server = await asyncio.start_server(service.handle, args.host, args.port)
+    print(f"Serving on {args.host}:{args.port}")
+    async with server:
+        while True:
+            await asyncio.sleep(args.stats_interval)
+            print(json.dumps(service.stats.snapshot(service.cache)))
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    print(args)
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass